@@ -22,38 +22,417 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import array
+import collections
+import itertools
+import time
+
 import xmmsclient
-from xmmsclient import collections as coll
 
+from . import loop
 from . import signals
 from . import xmms
 
 
+class _Chunk(object):
+  __slots__ = ('ids', 'n')
+
+  def __init__(self, ids):
+    self.ids = ids
+    self.n = 0 # slot in IdArray._slots
+
+
+class IdArray(object):
+  """Media ids packed in array chunks, with an optional index of their positions.
+
+  Chunks sit in slots, with chunk lengths in a Fenwick tree over the slots, so
+  finding, inserting, removing and moving by position cost O(log n) plus
+  shifting at most a chunk worth of ids. Every chunk is laid out with a free
+  slot after it, splitting a chunk in two takes the free slot and merging two
+  frees one, both as O(log n) tree updates. When the slot after a chunk is
+  taken the chunks after it are pushed along into a free slot close by, and
+  slots are added at the end as needed. The layout is only redone when there
+  is no free slot near, or too many slots are free.
+
+  The chunk last read from is remembered, reading rows one after the other
+  mostly gets away without a tree lookup.
+
+  The id => chunks index is built the first time positions() is called and
+  kept up to date by the editing methods from then on.
+  """
+
+  CHUNK = 512
+
+  def __init__(self, ids=()):
+    a = array.array('I', ids)
+    self._len = len(a)
+    self._index = None # id => chunk, or {chunk: count} if repeated
+    self._layout([_Chunk(a[i:i+self.CHUNK]) for i in range(0, len(a), self.CHUNK)])
+
+  def __len__(self):
+    return self._len
+
+  def __iter__(self):
+    return itertools.chain.from_iterable(c.ids for c in self._slots if c is not None)
+
+  def __getitem__(self, i):
+    # rows are mostly read one after the other, keep this path short
+    try:
+      if self._hit_start <= i < self._hit_end:
+        return self._hit_ids[i - self._hit_start]
+    except TypeError:
+      return self._slice(i)
+
+    if i < 0:
+      i += self._len
+    if i < 0 or i >= self._len:
+      raise IndexError('IdArray index out of range')
+
+    n, off = self._locate(i)
+    ids = self._remember(n, i - off)
+    return ids[off]
+
+  def _remember(self, n, start):
+    ids = self._slots[n].ids
+    self._hit_start = start
+    self._hit_end = start + len(ids)
+    self._hit_ids = ids
+    return ids
+
+  def _slice(self, s):
+    start, stop, step = s.indices(self._len)
+    if start >= stop:
+      return []
+
+    if self._hit_start <= start and stop <= self._hit_end:
+      base = self._hit_start
+      return self._hit_ids[start-base:stop-base:step].tolist()
+
+    n, off = self._locate(start)
+    if off + stop - start <= len(self._slots[n].ids):
+      ids = self._remember(n, start - off)
+      return ids[off:off+stop-start:step].tolist()
+
+    slots = self._slots
+    want = stop - start
+    r = None
+    while want > 0:
+      c = slots[n]
+      if c is not None:
+        part = c.ids[off:off+want]
+        if r is None:
+          r = part
+        else:
+          r += part
+        want -= len(part)
+        off = 0
+      n += 1
+
+    if step != 1:
+      r = r[::step]
+    return r.tolist()
+
+  def _forget_hit(self):
+    self._hit_start = self._hit_end = 0
+    self._hit_ids = None
+
+  def _layout(self, chunks):
+    """Put the chunks in fresh slots, each one followed by a free slot."""
+    slots = []
+    for c in chunks:
+      c.n = len(slots)
+      slots.append(c)
+      slots.append(None)
+
+    tree = [0] * (len(slots) + 1)
+    for c in chunks:
+      tree[c.n + 1] = len(c.ids)
+    for j in range(1, len(tree)):
+      k = j + (j & -j)
+      if k < len(tree):
+        tree[k] += tree[j]
+
+    self._slots = slots
+    self._nchunks = len(chunks)
+    self._tree = tree
+    self._topbit = slots and 1 << (len(slots).bit_length() - 1)
+    self._forget_hit()
+
+  def _append_free(self):
+    m = len(self._slots)
+    self._slots.append(None)
+    j = m + 1
+    # the new slot is empty, its node only sums the ones before it
+    self._tree.append(self._offset(m) - self._offset(j - (j & -j)))
+    self._topbit = 1 << (len(self._slots).bit_length() - 1)
+
+  def _make_room(self, n, k):
+    """Free the k slots after slot n, moving the chunks there along into
+    free slots close by. False if there aren't enough of those."""
+    slots = self._slots
+    end, free = n + 1, 0
+    while free < k:
+      if end - n > k + 8:
+        return False
+      if end == len(slots):
+        self._append_free()
+      if slots[end] is None:
+        free += 1
+      end += 1
+
+    moving = [c for c in slots[n+1:end] if c is not None]
+    for c in moving:
+      slots[c.n] = None
+      self._update(c.n, -len(c.ids))
+    for i, c in enumerate(moving):
+      c.n = end - len(moving) + i
+      slots[c.n] = c
+      self._update(c.n, len(c.ids))
+    return True
+
+  def _update(self, n, delta):
+    tree = self._tree
+    i = n + 1
+    while i < len(tree):
+      tree[i] += delta
+      i += i & -i
+
+  def _offset(self, n):
+    """Number of ids in the slots before slot n."""
+    tree = self._tree
+    s = 0
+    while n > 0:
+      s += tree[n]
+      n -= n & -n
+    return s
+
+  def _locate(self, pos):
+    """Return (slot, offset into its chunk) for 0 <= pos < len."""
+    tree = self._tree
+    i, bit = 0, self._topbit
+    while bit:
+      j = i + bit
+      if j < len(tree) and tree[j] <= pos:
+        i = j
+        pos -= tree[j]
+      bit >>= 1
+    return i, pos
+
+  def _next_chunk(self, n):
+    """Slot of the chunk after slot n, or None."""
+    slots = self._slots
+    for i in range(n + 1, len(slots)):
+      if slots[i] is not None:
+        return i
+    return None
+
+  def _last_chunk(self):
+    slots = self._slots
+    for i in range(len(slots) - 1, -1, -1):
+      if slots[i] is not None:
+        return i
+    return None
+
+  def _index_add(self, mid, chunk):
+    c = self._index.get(mid)
+    if c is None:
+      self._index[mid] = chunk
+      return
+    if not isinstance(c, dict):
+      c = self._index[mid] = {c: 1}
+    c[chunk] = c.get(chunk, 0) + 1
+
+  def _index_remove(self, mid, chunk):
+    c = self._index[mid]
+    if not isinstance(c, dict):
+      del self._index[mid]
+      return
+    if c[chunk] == 1:
+      del c[chunk]
+    else:
+      c[chunk] -= 1
+    if len(c) == 1:
+      only, count = next(iter(c.items()))
+      if count == 1:
+        self._index[mid] = only
+
+  def _reindex(self, old, new):
+    if self._index is None:
+      return
+    for c in old:
+      for mid in c.ids:
+        self._index_remove(mid, c)
+    for c in new:
+      for mid in c.ids:
+        self._index_add(mid, c)
+
+  def positions(self, mid):
+    if self._index is None:
+      self._index = {}
+      for c in self._slots:
+        if c is not None:
+          for m in c.ids:
+            self._index_add(m, c)
+
+    c = self._index.get(mid)
+    if c is None:
+      return []
+
+    r = []
+    for chunk in isinstance(c, dict) and c or [c]:
+      base = self._offset(chunk.n)
+      r.extend(base + i for i, m in enumerate(chunk.ids) if m == mid)
+    r.sort()
+    return r
+
+  def insert(self, pos, ids):
+    ids = array.array('I', ids)
+    if not ids:
+      return
+
+    self._forget_hit()
+    if not self._nchunks:
+      self._layout([_Chunk(array.array('I'))])
+
+    if pos >= self._len:
+      n = self._last_chunk()
+      off = len(self._slots[n].ids)
+    else:
+      n, off = self._locate(pos)
+
+    chunk = self._slots[n]
+    self._len += len(ids)
+
+    if len(chunk.ids) + len(ids) <= self.CHUNK*2:
+      chunk.ids[off:off] = ids
+      self._update(n, len(ids))
+      if self._index is not None:
+        for mid in ids:
+          self._index_add(mid, chunk)
+      return
+
+    a = chunk.ids[:off] + ids + chunk.ids[off:]
+    if len(a) <= self.CHUNK*4:
+      # halves, so it only takes the one free slot
+      half = len(a) // 2
+      new = [_Chunk(a[:half]), _Chunk(a[half:])]
+    else:
+      new = [_Chunk(a[i:i+self.CHUNK]) for i in range(0, len(a), self.CHUNK)]
+    self._reindex([chunk], new)
+
+    if self._make_room(n, len(new) - 1):
+      slots = self._slots
+      self._update(n, -len(chunk.ids))
+      for i, c in enumerate(new):
+        c.n = n + i
+        slots[n + i] = c
+        self._update(n + i, len(c.ids))
+      self._nchunks += len(new) - 1
+    else:
+      slots = self._slots
+      chunks = [c for c in slots[:n] if c is not None] + new + \
+               [c for c in slots[n+1:] if c is not None]
+      self._layout(chunks)
+
+  def nbytes(self):
+    return self._len * 4 + self._nchunks * 64 + len(self._slots) * 16
+
+  def append(self, mid):
+    self.insert(self._len, [mid])
+
+  def remove(self, pos):
+    self._forget_hit()
+    n, off = self._locate(pos)
+    chunk = self._slots[n]
+    mid = chunk.ids.pop(off)
+    self._len -= 1
+    self._update(n, -1)
+    if self._index is not None:
+      self._index_remove(mid, chunk)
+
+    if not chunk.ids:
+      self._slots[n] = None
+      self._nchunks -= 1
+    elif len(chunk.ids) < self.CHUNK//4:
+      # don't let removals leave lots of tiny chunks behind
+      t = self._next_chunk(n)
+      following = t is not None and self._slots[t]
+      if following and len(chunk.ids) + len(following.ids) <= self.CHUNK:
+        self._reindex([following], [])
+        chunk.ids.extend(following.ids)
+        if self._index is not None:
+          for m in following.ids:
+            self._index_add(m, chunk)
+        self._update(n, len(following.ids))
+        self._update(t, -len(following.ids))
+        self._slots[t] = None
+        self._nchunks -= 1
+
+    if len(self._slots) > 4 * self._nchunks + 16:
+      self._layout([c for c in self._slots if c is not None])
+
+    return mid
+
+  def move(self, pos, newpos):
+    self.insert(newpos, [self.remove(pos)])
+
+
+# args -- feeder:CollectionFeeder, ids:list
+signals.register('feeder-infos-loaded')
+
+# args -- feeder:CollectionFeeder, types:set of xmmsclient.PLAYLIST_CHANGED_*
+# an empty types set means the ids were (re)loaded from the server
+signals.register('feeder-ids-changed')
+
 class CollectionFeeder(object):
   def __init__(self, collection, fields, size=100):
     super(CollectionFeeder, self).__init__()
 
     self.xs = xmms.get()
+    self.cache = self.xs.cache
     self._collection = collection
     self.fields = fields
-    self.infos = {}
     self.size = size
     self.window = [0, 0]
-    self.ids = None
+    self.ids = IdArray()
     self.len = 0
+    self.focus = None # last position a walker had focused
+    self.loaded = False # the ids arrive asynchronously
+    self.active = True # infos are only fetched for someone looking
+    # ids asked for that haven't arrived yet, not asked for again meanwhile
+    self._requested = set()
+
+    # scroll tracking for read-ahead
+    self._cursor = 0
+    self._cursor_time = 0
+    self._direction = 0
+    self._velocity = 0.0 # rows/second
 
     self.reload_ids()
 
-    signals.connect('xmms-medialib-entry-changed', self.on_medialib_entry_changed)
+    signals.connect('medialib-infos-loaded', self.on_medialib_infos_loaded)
+    signals.connect('medialib-entries-changed', self.on_medialib_entries_changed)
+    signals.connect('medialib-infos-missing', self.on_medialib_infos_missing)
 
   def __getitem__(self, position):
+    """Return the info for position, or None if it hasn't been fetched yet.
+
+    Infos are fetched asynchronously, 'feeder-infos-loaded' is emitted when
+    they arrive.
+    """
+    if position < 0 or position >= self.len:
+      raise IndexError
+
     if not self._in_window(position):
       self._move_window(position)
 
-    try:
-      return self.infos[self.ids[position]]
-    except KeyError:
-      raise IndexError
+    mid = self.ids[position]
+    info = self.cache.get(mid, self.fields)
+    if info is None and mid not in self._requested:
+      # evicted or changed since the window was fetched
+      self._fetch(self.window[0], self.window[1])
+
+    return info
 
   def __len__(self):
     return self.len
@@ -61,8 +440,6 @@ class CollectionFeeder(object):
   def _set_collection(self, collection):
     self._collection = collection
     self.reload_ids()
-    self.reset_window()
-    self.infos = {}
 
   collection = property(lambda self: self._collection, _set_collection)
 
@@ -73,88 +450,343 @@ class CollectionFeeder(object):
       return None
 
   def id_positions(self, mid):
-    return [i for i,m in enumerate(self.ids) if m == mid]
+    return self.ids.positions(mid)
+
+  def get_info(self, mid):
+    """Return the cached info for mid, None if it isn't in yet."""
+    return self.cache.get(mid, self.fields)
 
   def reload_ids(self):
-    if hasattr(self.collection, 'ids') and self.collection.ids:
-      self.ids = list(self.collection.ids)
-    else:
-      self.ids = self.xs.coll_query_ids(self.collection)
+    """Load the ids of the collection, 'feeder-ids-changed' is emitted with
+    an empty set of types when they're in."""
+    collection = self._collection
+    if collection is None:
+      self._set_ids([])
+      return
+
+    if hasattr(collection, 'ids') and collection.ids:
+      self._set_ids(collection.ids)
+      signals.emit('feeder-ids-changed', self, set())
+      return
+
+    def _cb(r):
+      if self._collection is not collection:
+        # replaced while the query was on its way
+        return
+      ids = r.value()
+      if r.iserror() or type(ids) != list:
+        ids = []
+      self._set_ids(ids)
+      signals.emit('feeder-ids-changed', self, set())
 
+    self.xs.coll_query_ids(collection, cb=_cb, sync=False)
+
+  def _set_ids(self, ids):
+    self.ids = IdArray(ids)
     self.len = len(self.ids)
     self.reset_window()
+    self.loaded = True
 
   def reset_window(self):
     self.window = [0, 0]
 
+  def set_cursor(self, position):
+    """Tell the feeder where the focus is so it can fetch ahead of it."""
+    now = time.time()
+    delta = position - self._cursor
+    dt = now - self._cursor_time
+
+    if delta:
+      direction = delta > 0 and 1 or -1
+      if direction != self._direction or dt > 1.0:
+        self._velocity = 0.0
+      rate = abs(delta) / max(dt, 0.001)
+      self._velocity = (self._velocity + rate) / 2
+      self._direction = direction
+
+    self._cursor = self.focus = position
+    self._cursor_time = now
+
+    if self._in_window(position):
+      self._prefetch()
+
+  def _prefetch_depth(self):
+    # rows we'd scroll past during a couple of round trips at the current speed
+    depth = self.size//2 + int(self._velocity * self.cache.rtt * 2)
+    return min(depth, self.size*10)
+
+  def _prefetch(self):
+    depth = self._prefetch_depth()
+    maxspan = max(self.size*2, depth + self.size)
+
+    if self._direction > 0:
+      if self.window[1] >= self.len or self._cursor + depth < self.window[1]:
+        return
+      start = self.window[1]
+      end = min(max(self._cursor + depth, start + self.size//2), self.len)
+      self.window = [max(self.window[0], end - maxspan), end]
+    elif self._direction < 0:
+      if self.window[0] <= 0 or self._cursor - depth >= self.window[0]:
+        return
+      end = self.window[0]
+      start = max(min(self._cursor - depth, end - self.size//2), 0)
+      self.window = [start, min(self.window[1], start + maxspan)]
+    else:
+      return
+
+    self._fetch(start, end)
+
   def _in_window(self, n, inclusive=False):
     return n >= self.window[0] and n < self.window[1] + (inclusive and 1 or 0)
 
   def _move_window(self, center):
-    new_window = [max(center-self.size/2, 0), min(center+self.size/2, self.len)]
+    self.window = [max(center-self.size//2, 0), min(center+self.size//2, self.len)]
+    self._fetch(self.window[0], self.window[1])
 
-    #overlap = (max(self.window[0], new_window[0]), min(self.window[1], new_window[1]))
-    #if overlap[1] - overlap[0] > 0:
-    #  self.infos = dict((i, self.infos[i]) for i in self.ids[overlap[0]:overlap[1]])
-    #  left = min(self.window[0], new_window[0])
-    #  right = max(self.window[1], new_window[1])
-    #else:
-    #  self.infos = {}
-    #  req_ids = self.ids[new_window[0]:new_window[1]]
+  def set_active(self, active):
+    """Stop or start fetching infos, the window is caught up on restart."""
+    was, self.active = self.active, active
+    if active and not was:
+      self._fetch(self.window[0], self.window[1])
+
+  def _fetch(self, start, end):
+    if not self.active:
+      return
 
-    c = coll.IDList()
-    c.ids += self.ids[new_window[0]:new_window[1]]
-    for info in self.xs.coll_query_infos(c, self.fields):
-      self.infos[info['id']] = info
+    # the cache also skips what's already on its way
+    ids = self.cache.missing(self.ids[start:end], self.fields)
+    if ids:
+      self._requested.update(ids)
+      self.cache.fetch(ids, self.fields)
 
-    self.window = new_window
+  def on_medialib_entries_changed(self, ids):
+    self._requested.difference_update(ids)
 
-  def on_medialib_entry_changed(self, mid):
-    if mid in self.infos:
-      self.infos[mid] = self.xs.medialib_get_info(mid)
+  def on_medialib_infos_missing(self, ids):
+    # the next miss on them asks again
+    self._requested.difference_update(ids)
+
+  def on_medialib_infos_loaded(self, ids):
+    # the walkers have placeholders for whatever we asked for, even if the
+    # window moved on since
+    window_ids = set(self.ids[self.window[0]:self.window[1]])
+    loaded = [mid for mid in ids if mid in self._requested or mid in window_ids]
+    self._requested.difference_update(ids)
+    if loaded:
+      signals.emit('feeder-infos-loaded', self, loaded)
+
+  def nbytes(self):
+    """Rough amount of memory held by the feeder."""
+    return self.ids.nbytes() + 512
+
+  def close(self):
+    signals.disconnect('medialib-infos-loaded', self.on_medialib_infos_loaded)
+    signals.disconnect('medialib-entries-changed', self.on_medialib_entries_changed)
+    signals.disconnect('medialib-infos-missing', self.on_medialib_infos_missing)
 
 
 class PlaylistFeeder(CollectionFeeder):
   def __init__(self, pls_name, fields, size=100):
     self.xs = xmms.get()
     self.name = pls_name
+    self._changes = []
+    # changes until the playlist arrives are already in it
+    self._resyncing = True
 
-    c = self.xs.coll_get(pls_name, 'Playlists')
-    super(PlaylistFeeder, self).__init__(c, fields, size)
+    super(PlaylistFeeder, self).__init__(None, fields, size)
+    self.loaded = False
+    self.current_pos = self.xs.state.current_pos.get(pls_name, -1)
 
     signals.connect('xmms-playlist-changed', self._on_playlist_changed)
+    signals.connect('xmms-playlist-current-pos', self._on_playlist_current_pos)
+
+    self.xs.coll_get(pls_name, 'Playlists', cb=self._on_coll_get, sync=False)
+
+  def _on_coll_get(self, r):
+    self._resyncing = False
+    if r.iserror():
+      self._set_ids([])
+    else:
+      c = self._collection = r.value()
+      try:
+        self.current_pos = int(c.attributes.get('position', -1))
+      except ValueError:
+        pass
+      self._set_ids(c.ids)
+
+    signals.emit('feeder-ids-changed', self, set())
+
+  def close(self):
+    super(PlaylistFeeder, self).close()
+    signals.disconnect('xmms-playlist-changed', self._on_playlist_changed)
+    signals.disconnect('xmms-playlist-current-pos', self._on_playlist_current_pos)
+
+  def _on_playlist_current_pos(self, pls, pos):
+    if pls == self.name:
+      self.current_pos = pos
 
   def _on_playlist_changed(self, pls, type, mid, pos, newpos):
-    if pls != self.name:
+    if pls != self.name or self._resyncing:
       return
 
-    if type == xmmsclient.PLAYLIST_CHANGED_ADD:
-      if self._in_window(pos, inclusive=True):
-        self.window[1] += 1
-        if mid not in self.infos:
-          self.infos[mid] = self.xs.medialib_get_info(mid)
-      self.ids.append(mid)
-      self.len += 1
-    elif type == xmmsclient.PLAYLIST_CHANGED_INSERT:
-      if self._in_window(pos):
-        self.window[1] += 1
-        if mid not in self.infos:
-          self.infos[mid] = self.xs.medialib_get_info(mid)
-      self.ids.insert(pos, mid)
-      self.len += 1
-    elif type == xmmsclient.PLAYLIST_CHANGED_REMOVE:
-      if self._in_window(pos):
-        self.window[1] -= 1
-      del self.ids[pos]
-      self.len -= 1
-    elif type == xmmsclient.PLAYLIST_CHANGED_MOVE:
-      self.ids.insert(newpos, self.ids.pop(pos))
-    elif type == xmmsclient.PLAYLIST_CHANGED_CLEAR:
-      self.window = [0, 0]
-      self.infos = {}
-      self.ids = []
-      self.len = 0
-    else:
-      self.window = [0, 0]
-      self.reload_ids()
+    # adding a collection sends one event per entry, apply them all at once
+    if not self._changes:
+      loop.call_soon(self._apply_changes)
+    self._changes.append((type, mid, pos, newpos))
+
+  def _apply_changes(self):
+    changes, self._changes = self._changes, []
+    types = set(c[0] for c in changes)
+
+    if types - set([xmmsclient.PLAYLIST_CHANGED_ADD,
+                    xmmsclient.PLAYLIST_CHANGED_INSERT,
+                    xmmsclient.PLAYLIST_CHANGED_REMOVE,
+                    xmmsclient.PLAYLIST_CHANGED_MOVE,
+                    xmmsclient.PLAYLIST_CHANGED_CLEAR]):
+      self._resync(types)
+      return
+
+    fetch = False
+    i, n = 0, len(changes)
+    while i < n:
+      type, mid, pos, newpos = changes[i]
+      i += 1
+
+      if type in (xmmsclient.PLAYLIST_CHANGED_ADD, xmmsclient.PLAYLIST_CHANGED_INSERT):
+        # entries going in one after the other
+        run = [mid]
+        while i < n and changes[i][0] == type and changes[i][2] == pos + len(run):
+          run.append(changes[i][1])
+          i += 1
+
+        self.ids.insert(pos, run)
+        self.len += len(run)
+
+        if pos < self.window[0]:
+          self.window = [self.window[0] + len(run), self.window[1] + len(run)]
+        elif self._in_window(pos, inclusive=True):
+          self.window[1] = min(self.window[1] + len(run),
+                               max(self.window[1], self.window[0] + self.size*2))
+          fetch = True
+      elif type == xmmsclient.PLAYLIST_CHANGED_REMOVE:
+        if pos < self.window[0]:
+          self.window = [self.window[0] - 1, self.window[1] - 1]
+        elif self._in_window(pos):
+          self.window[1] -= 1
+        self.ids.remove(pos)
+        self.len -= 1
+      elif type == xmmsclient.PLAYLIST_CHANGED_MOVE:
+        self.ids.move(pos, newpos)
+      elif type == xmmsclient.PLAYLIST_CHANGED_CLEAR:
+        self.window = [0, 0]
+        self.ids = IdArray()
+        self.len = 0
+
+    if fetch:
+      self._fetch(self.window[0], self.window[1])
+
+    signals.emit('feeder-ids-changed', self, types)
+
+  def _resync(self, types):
+    """Fetch the new order after a sort, shuffle or update.
+
+    The ids themselves don't change so cached infos stay valid. Events
+    received until the answer arrives are already reflected in it.
+    """
+    def _cb(r):
+      self._resyncing = False
+      if r.iserror():
+        return
+
+      self.ids = IdArray(r.value())
+      self.len = len(self.ids)
+      self.window = [min(self.window[0], self.len), min(self.window[1], self.len)]
+      self._fetch(self.window[0], self.window[1])
+
+      signals.emit('feeder-ids-changed', self, types)
+
+    self._resyncing = True
+    self.xs.playlist_list_entries(self.name, cb=_cb, sync=False)
+
+
+class PlaylistFeederPool(object):
+  """PlaylistFeeders kept around after the walkers using them are gone.
+
+  They keep following the changes to their playlist, so going back to one
+  only needs the infos that came in while it was idle, and the focus is where
+  it was left. Feeders not in use don't fetch infos, and are dropped, least recently used first, once the pool and the
+  reserved bytes (the walkers' widgets) together go over budget.
+  """
+
+  def __init__(self, budget=16*1024*1024):
+    self.budget = budget
+    self.reserved = 0 # part of the budget used by others
+    self._feeders = collections.OrderedDict() # (pls, fields) => feeder
+    self._refs = {} # feeder => number of users
+
+    signals.connect('xmms-collection-changed', self.on_xmms_collection_changed)
+
+  def acquire(self, pls, fields):
+    key = (pls, tuple(fields))
+    try:
+      feeder = self._feeders.pop(key)
+    except KeyError:
+      feeder = PlaylistFeeder(pls, fields)
+    self._feeders[key] = feeder
+    self._refs[feeder] = self._refs.get(feeder, 0) + 1
+    feeder.set_active(True)
+    self.trim()
+    return feeder
+
+  def release(self, feeder):
+    n = self._refs.get(feeder, 0) - 1
+    if n > 0:
+      self._refs[feeder] = n
+      return
+
+    self._refs.pop(feeder, None)
+    # it keeps up with its playlist, but nobody needs the infos meanwhile
+    feeder.set_active(False)
+    if feeder not in self._feeders.values():
+      # its playlist went away while it was in use
+      feeder.close()
+    self.trim()
+
+  def _drop(self, key):
+    feeder = self._feeders.pop(key)
+    if feeder not in self._refs:
+      feeder.close()
+
+  def nbytes(self):
+    return sum(f.nbytes() for f in self._feeders.values())
+
+  def trim(self):
+    total = self.nbytes() + self.reserved
+    for key, feeder in list(self._feeders.items()):
+      if total <= self.budget:
+        break
+      if feeder not in self._refs:
+        total -= feeder.nbytes()
+        self._drop(key)
+
+  def on_xmms_collection_changed(self, pls, type, namespace, newname):
+    if namespace != 'Playlists':
+      return
+
+    keys = [k for k in self._feeders if k[0] == pls]
+    if type == xmmsclient.COLLECTION_CHANGED_RENAME:
+      for key in keys:
+        feeder = self._feeders.pop(key)
+        feeder.name = newname
+        self._feeders[(newname, key[1])] = feeder
+    elif type == xmmsclient.COLLECTION_CHANGED_REMOVE:
+      for key in keys:
+        self._drop(key)
+
+_pool = None
 
+def playlist_feeders():
+  global _pool
+  if _pool is None:
+    _pool = PlaylistFeederPool()
+  return _pool
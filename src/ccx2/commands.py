@@ -126,12 +126,16 @@ class CommandManager(object):
 
 _commands = set([
     'activate',
+    'cache-stats',
     'clear',
     'cycle',
     'info',
     'insert',
     'goto',
     'keycode',
+    'mark-all',
+    'mark-matching',
+    'mark-range',
     'move',
     'nav',
     'new',
@@ -158,6 +162,8 @@ _commands = set([
 
 help = {
     'global': {
+        'cache-stats': {'usage': 'cache-stats',
+                        'desc': 'Show the hits and misses of the caches.'},
         'clear': {'usage': 'clear',
                   'desc': 'Clear the current playlist.'},
         'nav': {'usage': 'nav up|down|left|right|page-up|page-down|home|end',
@@ -223,6 +229,13 @@ help = {
                          "The focused song is moved if no songs are marked."},
         'toggle': {'usage': 'toggle [<pos>]',
                    'desc': "Toggle mark on position or focused song if no position is given."},
+        'mark-all': {'usage': 'mark-all',
+                     'desc': "Mark all songs."},
+        'mark-matching': {'usage': 'mark-matching <pattern>',
+                          'desc': "Mark the songs matching pattern."},
+        'mark-range': {'usage': 'mark-range [<from>] <to>',
+                       'desc': "Mark the songs between two positions, or between the "
+                               "focused song and a position."},
         'unmark-all': {'usage': 'unmark-all',
                        'desc': "Unmark all songs."},
     },
@@ -245,6 +258,13 @@ help = {
                  'desc': "Save the current search as a collection."},
         'toggle': {'usage': 'toggle [<pos>]',
                    'desc': "Toggle mark on position or focused song if no position is given."},
+        'mark-all': {'usage': 'mark-all',
+                     'desc': "Mark all songs."},
+        'mark-matching': {'usage': 'mark-matching <pattern>',
+                          'desc': "Mark the songs matching pattern."},
+        'mark-range': {'usage': 'mark-range [<from>] <to>',
+                       'desc': "Mark the songs between two positions, or between the "
+                               "focused song and a position."},
         'unmark-all': {'usage': 'unmark-all',
                        'desc': "Unmark all songs."},
     },
@@ -65,6 +65,7 @@ _default_palette = {
     'marked-focus': ('marked-focus','black','brown'),
     'active': ('active','light blue', 'default'),
     'active-focus': ('active-focus','black', 'dark blue'),
+    'placeholder': ('placeholder','dark gray', 'default'),
     'headerbar': ('headerbar','default', 'default'),
     'status': ('status','default', 'default'),
     'searchinput': ('searchinput','yellow', 'default'),
@@ -120,6 +121,7 @@ class Config(object):
           path = None
 
     self.path = path
+    self.dir = path and os.path.dirname(os.path.abspath(path)) or None
     self.cp = configparser.SafeConfigParser()
 
     try:
@@ -191,8 +193,15 @@ class Config(object):
       if k in ('search-find-as-you-type',
                'autostart-server',
                'show-cover',
-               'playlist-switcher-in-own-tab'):
+               'playlist-switcher-in-own-tab',
+               'disk-cache'):
         setattr(self, rx.sub('_', k), self.cp.getboolean('options', k))
+      elif k in ('playlist-cache-size',
+                 'playlist-song-widgets',
+                 'playlist-row-widgets',
+                 'search-widgets',
+                 'max-fps'):
+        setattr(self, rx.sub('_', k), self.cp.getint('options', k))
       else:
         setattr(self, rx.sub('_', k), v)
 
@@ -240,6 +249,19 @@ search-find-as-you-type = yes
 show-cover = yes
 ; show the playlist switcher in a separate tab
 playlist-switcher-in-own-tab = no
+; keep song infos in a file next to this one, makes startup faster with
+; remote servers
+disk-cache = no
+; megabytes worth of recently viewed playlists (their ids and rows) to keep
+; ready for switching back to them
+playlist-cache-size = 16
+; songs and rows scrolled past whose widgets are kept around, per playlist
+playlist-song-widgets = 2000
+playlist-row-widgets = 500
+; same for the search results
+search-widgets = 2000
+; most screen updates per second, bursts of changes are drawn together
+max-fps = 30
 
 ; format strings to use, define them in the formatting section
 ; format for the now playing tab
@@ -422,6 +444,7 @@ marked = yellow,default
 marked-focus = black,brown
 active = light blue,default
 active-focus = black,dark blue
+placeholder = dark gray,default
 headerbar = default,default
 status = default,default
 searchinput = light magenta,default
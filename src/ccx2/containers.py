@@ -45,6 +45,9 @@ class TabContainer(urwid.Pile):
     w = self.tabs[self.cur_tab][1]
     self.tab_w = urwid.WidgetWrap(w)
 
+    if hasattr(w, "tab_loaded"):
+      w.tab_loaded()
+
     self.__super.__init__([('flow', self.tabbar),
                            ('flow', urwid.Divider('\u2500')),
                            self.tab_w],
@@ -79,7 +82,7 @@ class TabContainer(urwid.Pile):
     if hasattr(self.tabs[self.cur_tab][1], "tab_loaded"):
       self.tabs[self.cur_tab][1].tab_loaded()
 
-    if hasattr(self.tabs[self.prev_tab][1], "tab_unloaded"):
+    if self.prev_tab != self.cur_tab and hasattr(self.tabs[self.prev_tab][1], "tab_unloaded"):
       self.tabs[self.prev_tab][1].tab_unloaded()
 
     signals.emit('need-redraw')
@@ -28,7 +28,9 @@ from xmmsclient import collections as coll
 
 from . import commands
 from . import containers
+from . import rangemap
 from . import signals
+from . import util
 from . import xmms
 
 BADROWSMSG = "Widget %s at position %s within listbox calculated %d rows but rendered %d!"
@@ -46,35 +48,87 @@ class AttrListBox(urwid.ListBox):
     self.attr = attr
     self.focus_attr = focus_attr
     self.focus_str = focus_str
-    self.row_attrs = row_attrs is not None and row_attrs or {}
+    self.row_attrs = row_attrs is not None and row_attrs or {} # attr => RangeMap
+    self._attr_priority = dict((a, 0) for a in self.row_attrs)
 
     self._bottom_pos = None
     self._top_pos = None
     self._focus_pos = None
 
+    # (widget, attr, maxcol, focus) => (widget canvas, attr filled canvas)
+    self._row_canvases = util.LRUDict(256, name='row canvases')
+
+  def attr_map(self, attr, priority=0):
+    """Return the RangeMap of rows with attr, the highest priority attr wins."""
+    try:
+      return self.row_attrs[attr]
+    except KeyError:
+      self._attr_priority[attr] = priority
+      m = self.row_attrs[attr] = rangemap.RangeMap()
+      return m
+
   def get_row_attr(self, pos):
-    return self.row_attrs.get(pos, [(self.attr, 0)])[-1][0]
+    attr, priority = self.attr, None
+    for a, m in self.row_attrs.items():
+      if pos in m and (priority is None or self._attr_priority[a] >= priority):
+        attr, priority = a, self._attr_priority[a]
+    return attr
+
+  def has_row_attr(self, pos):
+    return any(pos in m for m in self.row_attrs.values())
 
   def set_row_attr(self, pos, attr, priority=0):
-    self.row_attrs[pos] = [(attr, priority)]
+    # only attr's own map, the row keeps its other attributes and its mark
+    self.add_row_attr(pos, attr, priority)
 
   def add_row_attr(self, pos, attr, priority=0):
-    self.row_attrs.setdefault(pos, []).append((attr, priority))
-    self.row_attrs[pos].sort(key=lambda e: e[1])
+    self.attr_map(attr, priority).set(pos, pos+1)
 
   def remove_row_attr(self, pos, attr):
     try:
-      for a in self.row_attrs[pos]:
-        if a[0] == attr:
-          self.row_attrs[pos].remove(a)
-          break
-      if not self.row_attrs[pos]:
-        del self.row_attrs[pos]
+      self.row_attrs[attr].discard(pos, pos+1)
     except KeyError:
       pass
 
   def clear_attrs(self):
-    self.row_attrs = {}
+    for m in self.row_attrs.values():
+      m.clear()
+
+  def insert_rows(self, pos, n=1):
+    """Shift the attributes to follow n rows being inserted at pos."""
+    for m in self.row_attrs.values():
+      m.insert(pos, n)
+    self._invalidate()
+
+  def remove_rows(self, pos, n=1):
+    for m in self.row_attrs.values():
+      m.remove(pos, n)
+    self._invalidate()
+
+  def move_row(self, pos, newpos):
+    for m in self.row_attrs.values():
+      m.move(pos, newpos)
+    self._invalidate()
+
+  def _render_row(self, widget, attr, maxcol, focus=False):
+    """Render a row with attr filled in, reusing the last one if unchanged.
+
+    The widget's canvas comes out of urwid's cache as the same object until the
+    widget is invalidated, so that's what tells the filled copy is stale.
+    """
+    canvas = widget.render((maxcol,), focus=focus)
+    if not attr:
+      return canvas
+
+    key = (widget, attr, maxcol, focus)
+    cached = self._row_canvases.get(key)
+    if cached is not None and cached[0] is canvas:
+      return cached[1]
+
+    filled = urwid.CompositeCanvas(canvas)
+    filled.fill_attr(attr)
+    self._row_canvases[key] = (canvas, filled)
+    return filled
 
   def render(self, size, focus=False ):
     """Render listbox and return canvas. """
@@ -104,30 +158,22 @@ class AttrListBox(urwid.ListBox):
     fill_above.reverse() # fill_above is in bottom-up order
 
     for widget,w_pos,w_rows in fill_above:
-      canvas = widget.render((maxcol,))
-      attr = self.get_row_attr(w_pos)
-      if attr:
-        canvas = urwid.CompositeCanvas(canvas)
-        canvas.fill_attr(attr)
+      canvas = self._render_row(widget, self.get_row_attr(w_pos), maxcol)
 
       if w_rows != canvas.rows():
         raise urwid.ListBoxError(BADROWSMSG % (repr(widget),repr(w_pos),w_rows, canvas.rows()))
       rows += w_rows
       combinelist.append((canvas, w_pos, False))
     
-    focus_canvas = focus_widget.render((maxcol,), focus=focus)
-
     focus_attr = None
-    if focus_pos in self.row_attrs:
+    if self.has_row_attr(focus_pos):
       focus_attr = self.get_row_attr(focus_pos)
       if focus and self.focus_str:
         focus_attr += self.focus_str
     elif focus:
       focus_attr = self.focus_attr
 
-    if focus_attr:
-      focus_canvas = urwid.CompositeCanvas(focus_canvas)
-      focus_canvas.fill_attr(focus_attr)
+    focus_canvas = self._render_row(focus_widget, focus_attr, maxcol, focus)
 
     if focus_canvas.rows() != focus_rows:
       raise ListBoxError(BADFOCUSROWSMSG % (repr(focus_widget), repr(focus_pos),
@@ -140,11 +186,7 @@ class AttrListBox(urwid.ListBox):
     combinelist.append((focus_canvas, focus_pos, True))
     
     for widget,w_pos,w_rows in fill_below:
-      canvas = widget.render((maxcol,))
-      attr = self.get_row_attr(w_pos)
-      if attr:
-        canvas = urwid.CompositeCanvas(canvas)
-        canvas.fill_attr(attr)
+      canvas = self._render_row(widget, self.get_row_attr(w_pos), maxcol)
       if w_rows != canvas.rows():
         raise urwid.ListBoxError(BADROWSMSG  % (repr(widget),repr(w_pos),w_rows, canvas.rows()))
       rows += w_rows
@@ -173,13 +215,24 @@ class AttrListBox(urwid.ListBox):
   def keypress(self, size, key):
     return self.__super.keypress(size, key)
 
+# mark data of rows marked in bulk, looked up by position when needed
+_RANGE = object()
+
 class MarkableListBox(AttrListBox):
   def __init__(self, body):
-    self._marked_data = {}
-
     self.__super.__init__(body, focus_attr='focus', focus_str='-focus')
 
-  marked_data = property(lambda self: self._marked_data)
+    # marked rows, with their mark data as value
+    self._marks = self.attr_map('marked', 100)
+
+  def marked_items(self):
+    """Iterate over (position, mark data) of the marked rows, in order."""
+    for start, end, data in self._marks.ranges():
+      for pos in range(start, end):
+        if data is _RANGE:
+          yield pos, self.get_mark_data(pos, None)
+        else:
+          yield pos, data
 
   def get_mark_data(self, pos, w):
     return pos
@@ -191,17 +244,26 @@ class MarkableListBox(AttrListBox):
 
   def toggle_mark(self, pos, data):
     if pos >= 0 and pos < len(self.body):
-      if pos in self._marked_data:
-        del self._marked_data[pos]
-        self.remove_row_attr(pos, 'marked')
+      if pos in self._marks:
+        self._marks.discard(pos, pos+1)
       else:
-        self._marked_data[pos] = data
-        self.add_row_attr(pos, 'marked', 100)
+        self._marks.set(pos, pos+1, data)
+
+  def mark_range(self, start, end):
+    """Mark the rows in [start, end)."""
+    start, end = max(start, 0), min(end, len(self.body))
+    if start < end:
+      self._marks.set(start, end, _RANGE)
+      self._invalidate()
+
+  def mark_all(self):
+    self.mark_range(0, len(self.body))
+
+  def all_marked(self):
+    return len(self.body) > 0 and len(self._marks) == len(self.body)
 
   def unmark_all(self):
-    self._marked_data.clear()
-    for pos in list(self.row_attrs.keys()):
-      self.remove_row_attr(pos, 'marked')
+    self._marks.clear()
     self._invalidate()
 
   def cmd_nav(self, args):
@@ -229,6 +291,26 @@ class MarkableListBox(AttrListBox):
   def cmd_unmark_all(self, args):
     self.unmark_all()
 
+  def cmd_mark_range(self, args):
+    try:
+      bounds = [int(a)-1 for a in args.split()]
+    except ValueError:
+      raise commands.CommandError("valid positions required")
+
+    if len(bounds) == 1:
+      pos = self.get_focus()[1]
+      if pos is None:
+        return
+      bounds.insert(0, pos)
+    elif len(bounds) != 2:
+      raise commands.CommandError("one or two positions required")
+
+    start, end = sorted(bounds)
+    self.mark_range(start, end+1)
+
+  def cmd_mark_all(self, args):
+    self.mark_all()
+
 
 class SongListBox(MarkableListBox):
   def __init__(self, app, body):
@@ -240,18 +322,21 @@ class SongListBox(MarkableListBox):
     fields = args.split()
     w, p = self.get_focus()
     if w is not None:
-      info = self.xs.medialib_get_info(w.mid)
-      q = ' AND '.join('%s:"%s"' % (f, info[f]) for f in fields if info.get(f))
-      if q:
-        self.app.search(q)
-      else:
-        pass # TODO: error message
+      def _cb(info):
+        q = ' AND '.join('%s:"%s"' % (f, info[f]) for f in fields if info.get(f))
+        if q:
+          self.app.search(q)
+        else:
+          pass # TODO: error message
+      self.xs.cache.get_info(w.mid, fields, cb=_cb, sync=False)
 
   def cmd_info(self, args):
     w, p = self.get_focus()
     if w:
-      info = self.xs.medialib_get_info(w.mid)
-      self.app.show_dialog(containers.InfoDialog(self.app, info, self.app.view.body)) # FIXME
+      def _cb(info):
+        self.app.show_dialog(containers.InfoDialog(self.app, info, self.app.view.body)) # FIXME
+        signals.emit('need-redraw')
+      self.xs.cache.get_info(w.mid, cb=_cb, sync=False)
 
   def cmd_insert(self, args):
     pos = None
@@ -273,10 +358,10 @@ class SongListBox(MarkableListBox):
 
       if pos:
         if relative:
-          try:
-            cur = self.xs.playlist_current_pos()['position']
+          cur = self.xs.state.active_pos()
+          if cur is not None:
             pos = cur + pos + (args[0][0] == '-' and 1 or 0)
-          except:
+          else:
             pos = None
         else:
           pos -= 1
@@ -293,54 +378,105 @@ class SongListBox(MarkableListBox):
     if w is None:
       return
 
-    info = self.xs.medialib_get_info(w.mid)
-    if field not in info:
-      raise commands.CommandError("the song doesn't have a value for '%s'" % field)
+    def _cb(info):
+      if field not in info:
+        signals.emit('show-message',
+                     "the song doesn't have a value for '%s'" % field, 'error')
+        return
 
-    c = coll.Equals(field=field, value=info[field].encode('utf-8'))
+      c = coll.Equals(field=field, value=info[field].encode('utf-8'))
 
-    if pos is None:
-      self.xs.playlist_add_collection(c, ['id'], sync=False)
-    else:
-      self.xs.playlist_insert_collection(int(pos), c, ['id'], sync=False)
+      if pos is None:
+        self.xs.playlist_add_collection(c, ['id'], sync=False)
+      else:
+        self.xs.playlist_insert_collection(int(pos), c, ['id'], sync=False)
 
-    pos_s = pos is not None and "at position %d" % (pos+1) or ''
-    msg = 'added songs matching %s="%s" to playlist %s' % (field, info[field], pos_s)
-    signals.emit('show-message', msg)
+      pos_s = pos is not None and "at position %d" % (pos+1) or ''
+      msg = 'added songs matching %s="%s" to playlist %s' % (field, info[field], pos_s)
+      signals.emit('show-message', msg)
 
-  def insert_marked(self, pos=None):
-    m = list(self.marked_data.values())
+    self.xs.cache.get_info(w.mid, [field], cb=_cb, sync=False)
+
+  def match_collection(self):
+    """The collection mark-matching patterns are matched within."""
+    return self.body.feeder.collection
 
-    if not m:
+  def mark_matching(self, pattern):
+    feeder = self.body.feeder
+
+    def _cb(r):
+      if r.iserror() or self.body.feeder is not feeder:
+        return
+      # one pass over the ids, neighbouring matches make a single run
+      matches = set(r.value())
+      runs = []
+      for pos, mid in enumerate(feeder.ids):
+        if mid in matches:
+          if runs and runs[-1][1] == pos:
+            runs[-1][1] = pos + 1
+          else:
+            runs.append([pos, pos + 1, _RANGE])
+      self._marks.update(runs)
+      self._invalidate()
+      signals.emit('need-redraw')
+
+    c = coll.Intersection(self.match_collection(), pattern)
+    self.xs.coll_query_ids(c, cb=_cb, sync=False)
+
+  def cmd_mark_matching(self, args):
+    try:
+      c = coll.coll_parse(args)
+    except ValueError:
+      raise commands.CommandError('bad pattern')
+
+    self.mark_matching(c)
+
+  def marked_collection(self):
+    """Return the marked songs, in order, as a collection."""
+    feeder = self.body.feeder
+    ids = []
+    for start, end, data in self._marks.ranges():
+      if data is _RANGE:
+        ids.extend(feeder.ids[start:end])
+      else:
+        ids.extend([data] * (end-start))
+
+    idl = coll.IDList()
+    idl.ids += ids
+    return idl
+
+  def insert_marked(self, pos=None):
+    if self._marks:
+      c = self.marked_collection()
+      n = len(self._marks)
+    else:
       w, p = self.get_focus()
 
       if w is None:
         return
 
-      m = [w.mid]
+      c = coll.IDList()
+      c.ids += [w.mid]
+      n = 1
 
-    idl = coll.IDList()
-    idl.ids += m
     if pos is None:
-      self.xs.playlist_add_collection(idl, ['id'], sync=False)
+      self.xs.playlist_add_collection(c, ['id'], sync=False)
     else:
-      self.xs.playlist_insert_collection(int(pos), idl, ['id'], sync=False)
+      self.xs.playlist_insert_collection(int(pos), c, ['id'], sync=False)
 
-    n = len(idl.ids)
     pos_s = pos is not None and "at position %d" % (pos+1) or ''
     msg = "added %d song%s to playlist %s" % (n, n > 1 and 's' or '', pos_s)
     signals.emit('show-message', msg)
 
   def insert_marked_after_current(self):
-    def _cb(r):
-      if not r.iserror():
-        v = r.value()
-        if v == 'no current entry':
-          self.insert_marked()
-        else:
-          self.insert_marked(pos=v['position']+1)
-    self.xs.playlist_current_pos(cb=_cb, sync=False)
+    cur = self.xs.state.active_pos()
+    if cur is None:
+      self.insert_marked()
+    else:
+      self.insert_marked(pos=cur+1)
 
   def get_mark_data(self, pos, w):
+    if w is None:
+      return self.body.feeder.position_id(pos)
     return w.mid
 
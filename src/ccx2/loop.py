@@ -0,0 +1,110 @@
+# Copyright (c) 2008-2009 Pablo Flouret <quuxbaz@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met: Redistributions of
+# source code must retain the above copyright notice, this list of conditions and
+# the following disclaimer. Redistributions in binary form must reproduce the
+# above copyright notice, this list of conditions and the following disclaimer in
+# the documentation and/or other materials provided with the distribution.
+# Neither the name of the software nor the names of its contributors may be
+# used to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# The event loop everything runs on, an asyncio one. The server connection and
+# the terminal are readers on it, deferred calls and timers are its callbacks,
+# and slow work (network, image decoding) runs in tasks, with the blocking
+# parts in a thread so the loop itself never blocks.
+
+import asyncio
+
+from . import signals
+
+_aio = None
+_error = None
+
+def get():
+  global _aio
+  if _aio is None:
+    _aio = asyncio.new_event_loop()
+    _aio.set_exception_handler(_on_error)
+  return _aio
+
+def _on_error(aio, context):
+  # let it blow up like it would without the loop in between
+  global _error
+  _error = context.get('exception') or RuntimeError(context['message'])
+  aio.stop()
+
+def call_soon(fun, *args):
+  """Call fun(*args) once the loop is done with what it's doing now."""
+  return get().call_soon(fun, *args)
+
+def call_later(delay, fun, *args):
+  """Call fun(*args) in delay seconds, return a handle to cancel() it."""
+  return get().call_later(delay, fun, *args)
+
+def spawn(coro):
+  """Run coro as a task, cancel() it to drop stale work."""
+  task = get().create_task(coro)
+  task.add_done_callback(_task_done)
+  return task
+
+def _task_done(task):
+  # one thing not working isn't worth stopping everything else for, unlike
+  # errors in the loop's own callbacks
+  if task.cancelled() or task.exception() is None:
+    return
+
+  e = task.exception()
+  if signals.connected('show-message'):
+    signals.emit('show-message', "error: %s" % (e or type(e).__name__), 'error')
+  else:
+    # nowhere to show it yet
+    _on_error(get(), {'message': 'task failed', 'exception': e})
+
+def in_thread(fun, *args):
+  """Return a future for fun(*args) run in a worker thread."""
+  return get().run_in_executor(None, fun, *args)
+
+def future():
+  return get().create_future()
+
+def wait(f):
+  """Run the loop until f is done and return its result.
+
+  Only for setting things up, it can't be used once run() is going.
+  """
+  return get().run_until_complete(f)
+
+def add_reader(fd, fun, *args):
+  get().add_reader(fd, fun, *args)
+
+def add_writer(fd, fun, *args):
+  get().add_writer(fd, fun, *args)
+
+def remove_writer(fd):
+  get().remove_writer(fd)
+
+def run():
+  """Run until stop() is called or something raises."""
+  global _error
+  get().run_forever()
+  if _error is not None:
+    e, _error = _error, None
+    raise e
+
+def stop():
+  get().stop()
@@ -22,98 +22,17 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import threading
-
 import urwid
 
 from . import commands
 from . import config
 from . import listbox
+from . import loop
 from . import lyricwiki
 from . import signals
 from . import widgets
 from . import xmms
 
-class FetcherThread(threading.Thread):
-  def __init__(self, lyrics, info, url=None):
-    self.lyrics = lyrics
-    self.info = info
-    self.url = url
-    self.abort = False
-
-    super(FetcherThread, self).__init__()
-    self.setDaemon(True)
-
-  def save_lyrics(self, lyrics):
-    self.lyrics.xs.medialib_property_set(
-        self.info['id'], 'lyrics', lyrics, 'client/generic', sync=False)
-
-  def from_url(self):
-    self.lyrics.set_info("fetching lyrics...")
-
-    lyrics = lyricwiki.get_lyrics(self.url)
-
-    if self.abort:
-      return
-
-    if lyrics:
-      self.save_lyrics(lyrics)
-      self.lyrics.set_lyrics(lyrics)
-    else:
-      self.lyrics.set_info("some kind of error occurred while fetching the lyrics, try again!")
-
-  def run(self):
-    if self.url:
-      self.from_url()
-      return
-
-    self.lyrics.set_info("searching for lyrics...")
-
-    artist, title = self.info.get('artist'), self.info.get('title')
-
-    if not artist or not title:
-      self.lyrics.set_info("artist or title not set, not enough info to search for lyrics")
-      return
-
-    lw = lyricwiki.LyricWiki(artist, title, self.info.get('album'), self.info.get('tracknr'))
-    lyrics = lw.get()
-
-    if lyrics:
-      self.save_lyrics(lyrics)
-    else:
-      self.lyrics.set_info("no direct match, searching for results...")
-      results = lw.get_song_results()
-
-    if self.abort:
-      return
-
-    if lyrics:
-      self.lyrics.set_lyrics(lyrics)
-    else:
-      self.lyrics.show_results(results)
-
-
-class ResultsFetcherThread(threading.Thread):
-  def __init__(self, lyrics, query):
-    self.lyrics = lyrics
-    self.query = query
-    self.abort = False
-
-    super(ResultsFetcherThread, self).__init__()
-    self.setDaemon(True)
-
-  def run(self):
-    self.lyrics.set_info("searching...")
-    signals.emit('need-redraw')
-
-    results = lyricwiki.get_google_results(self.query)
-
-    if self.abort:
-      return
-    
-    self.lyrics.show_results(results)
-
-
 class LyricsListBox(urwid.ListBox):
 
   def set_rows(self, rows):
@@ -150,9 +69,9 @@ class Lyrics(urwid.Pile):
 
     self.on_display = False
     self.info = None
-    self.fetcher_thread = None
-    self.results_fetcher_thread = None
-    self.lock = threading.RLock()
+    self.lyrics = None # fetched for info, it's shared with the cache so it stays as is
+    self.fetch_task = None
+    self.search_task = None
 
     self.input = widgets.InputEdit(caption='search lyricwiki.org > ')
     urwid.connect_signal(self.input, 'done', self.search)
@@ -173,77 +92,102 @@ class Lyrics(urwid.Pile):
 
   def on_xmms_playback_current_info(self, info):
     self.info = info
+    self.lyrics = None
     if self.on_display:
       self.fetch_lyrics()
 
   def search(self, widget, query):
-    if self.results_fetcher_thread:
-      self.results_fetcher_thread.abort = True
-    self.results_fetcher_thread = ResultsFetcherThread(self, query)
-    self.results_fetcher_thread.start()
+    if self.search_task:
+      self.search_task.cancel()
+    self.search_task = loop.spawn(self._search(query))
+
+  async def _search(self, query):
+    self.set_info("searching...")
+
+    # the network bits block, so they go to a thread
+    results = await loop.in_thread(lyricwiki.get_google_results, query)
+    self.show_results(results)
 
   def fetch_lyrics(self, url=None):
-    try:
-      self.lock.acquire()
+    self.set_lyrics('')
 
-      self.set_lyrics('')
+    if self.fetch_task:
+      self.fetch_task.cancel()
+      self.fetch_task = None
 
-      if self.fetcher_thread:
-        self.fetcher_thread.abort = True
+    if not url:
+      lyrics = self.lyrics or self.info.get('lyrics')
 
-      if not url:
-        lyrics = self.info.get('lyrics')
+      s = "%s %s" % (self.info.get('artist', ''), self.info.get('title', ''))
+      self.input.set_edit_text(s)
+      self.input.edit_pos = len(s)
 
-        s = "%s %s" % (self.info.get('artist', ''), self.info.get('title', ''))
-        self.input.set_edit_text(s)
-        self.input.edit_pos = len(s)
+      if lyrics:
+        self.set_lyrics(lyrics)
+        return
 
-        if lyrics:
-          self.set_lyrics(lyrics)
-          return
-      self.fetcher_thread = FetcherThread(self, self.info, url)
-      self.fetcher_thread.start()
-    finally:
-      self.lock.release()
+    self.fetch_task = loop.spawn(self._fetch(self.info, url))
 
-  def set_lyrics(self, lyrics):
-    try:
-      self.lock.acquire()
+  def _save_lyrics(self, info, lyrics):
+    if info is self.info:
+      self.lyrics = lyrics
+    self.xs.medialib_property_set(info['id'], 'lyrics', lyrics, 'client/generic', sync=False)
 
-      in_list_w = self.widget_list[-1]
-      if in_list_w != self.llbw:
-        self.widget_list[-1] = self.llbw
-        if self.focus_item == in_list_w:
-          self.set_focus(self.llbw)
+  async def _fetch(self, info, url=None):
+    if url:
+      self.set_info("fetching lyrics...")
+      lyrics = await loop.in_thread(lyricwiki.get_lyrics, url)
+      if lyrics:
+        self._save_lyrics(info, lyrics)
+        self.set_lyrics(lyrics)
+      else:
+        self.set_info("some kind of error occurred while fetching the lyrics, try again!")
+      return
 
-      if not self.info.get('lyrics'):
-        self.info[('client/generic', 'lyrics')] = lyrics
+    self.set_info("searching for lyrics...")
 
-      self.llb.set_rows([urwid.Text(l) for l in lyrics.split('\n')])
-      self.set_info()
-      self._invalidate()
-      signals.emit('need-redraw')
-    finally:
-      self.lock.release()
+    artist, title = info.get('artist'), info.get('title')
 
-  def show_results(self, results):
-    try:
-      self.lock.acquire()
+    if not artist or not title:
+      self.set_info("artist or title not set, not enough info to search for lyrics")
+      return
 
-      if self.widget_list[-1] != self.rlb:
-        self.widget_list[-1] = self.rlb
-        self.set_focus(self.rlb)
+    lw = lyricwiki.LyricWiki(artist, title, info.get('album'), info.get('tracknr'))
+    lyrics = await loop.in_thread(lw.get)
 
-      if results:
-        self.rlb.set_rows([widgets.LyricResultWidget(r[0], r[1]) for r in results])
-        self.set_info()
-      else:
-        self.set_info("no results found :/")
+    if lyrics:
+      self._save_lyrics(info, lyrics)
+      self.set_lyrics(lyrics)
+    else:
+      self.set_info("no direct match, searching for results...")
+      results = await loop.in_thread(lw.get_song_results)
+      self.show_results(results)
+
+  def set_lyrics(self, lyrics):
+    in_list_w = self.widget_list[-1]
+    if in_list_w != self.llbw:
+      self.widget_list[-1] = self.llbw
+      if self.focus_item == in_list_w:
+        self.set_focus(self.llbw)
+
+    self.llb.set_rows([urwid.Text(l) for l in lyrics.split('\n')])
+    self.set_info()
+    self._invalidate()
+    signals.emit('need-redraw')
+
+  def show_results(self, results):
+    if self.widget_list[-1] != self.rlb:
+      self.widget_list[-1] = self.rlb
+      self.set_focus(self.rlb)
 
-      self._invalidate()
-      signals.emit('need-redraw')
-    finally:
-      self.lock.release()
+    if results:
+      self.rlb.set_rows([widgets.LyricResultWidget(r[0], r[1]) for r in results])
+      self.set_info()
+    else:
+      self.set_info("no results found :/")
+
+    self._invalidate()
+    signals.emit('need-redraw')
 
   def set_info(self, msg=""):
     self.info_w.set_text(msg)
@@ -262,9 +206,10 @@ class Lyrics(urwid.Pile):
     self.on_display = True
 
     if not self.info:
-      self.on_xmms_playback_current_info(self.xs.playback_current_info())
-
-    self.fetch_lyrics()
+      # fetches the lyrics when the info arrives
+      self.xs.playback_current_info(self.on_xmms_playback_current_info, sync=False)
+    else:
+      self.fetch_lyrics()
 
   def tab_unloaded(self):
     self.on_display = False
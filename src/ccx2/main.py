@@ -26,7 +26,6 @@
 
 import curses
 import os
-import select
 import signal
 import sys
 import time
@@ -45,6 +44,7 @@ from . import commands
 from . import config
 from . import containers
 from . import help
+from . import loop
 from . import lyrics
 from . import mif
 from . import nowplaying
@@ -67,7 +67,7 @@ class HeaderBar(urwid.WidgetWrap):
     self.info = {}
     self.ctx = {}
     self.time = 0
-    self.status = self.xs.playback_status()
+    self.status = self.xs.state.status
     self.parser = mif.FormatParser(self.app.config.format('header'))
 
     self.text = urwid.Text('')
@@ -76,6 +76,7 @@ class HeaderBar(urwid.WidgetWrap):
     signals.connect('xmms-playback-status', self.on_xmms_playback_status)
     signals.connect('xmms-playback-current-info', self.on_xmms_playback_current_info)
     signals.connect('xmms-playback-playtime', self.on_xmms_playback_playtime)
+    self.xs.want_playtime(self)
 
     self.xs.playback_current_info(self.on_xmms_playback_current_info, sync=False)
 
@@ -87,10 +88,10 @@ class HeaderBar(urwid.WidgetWrap):
 
     self.text.set_text(self.parser.eval(self.ctx))
     self._invalidate()
-    signals.emit('need-redraw')
+    signals.emit('need-redraw', 'header')
 
   def on_xmms_playback_playtime(self, milli):
-    if self.time/1000 != milli/1000:
+    if self.time//1000 != milli//1000:
       self.time = milli
       self._update()
 
@@ -108,10 +109,13 @@ signals.register('show-message')
 signals.register('clear-message')
 
 class StatusArea(urwid.Pile):
+  message_timeout = 5 # seconds, loading messages stay until cleared
+
   def __init__(self):
     self.status = urwid.AttrWrap(urwid.Text(''), 'status')
     self._empty = urwid.Text('')
     self.last_type = None
+    self._expire_timer = None
 
     self.__super.__init__([self.status, self._empty], 1)
 
@@ -134,6 +138,11 @@ class StatusArea(urwid.Pile):
     self.status.set_text((attr, msg))
     signals.emit('need-redraw')
 
+    if self._expire_timer:
+      self._expire_timer.cancel()
+    if type != 'loading':
+      self._expire_timer = loop.call_later(self.message_timeout, self.clear_message)
+
   def clear_message(self, clear_loading=False):
     if clear_loading or self.last_type != 'loading':
       self.status.set_text('')
@@ -154,6 +163,7 @@ class StatusArea(urwid.Pile):
     self._invalidate()
 
 
+# args -- region:str, only 'header' for now, or None for everything
 signals.register('need-redraw')
 signals.register('window-resized')
 
@@ -166,12 +176,15 @@ class Ccx2(object):
     self.cm = commands.CommandManager(self.config)
     self.colors = 8
     self.show_key = False
-    self._pipe = os.pipe()
 
-    self.need_redraw = True
+    self._dirty = set([None]) # regions in need of a redraw
+    self._canvas = None # last full frame drawn
+    self._header_rows = 0
+    self._last_draw = 0
+    self._render_time = 0.0 # moving average, seconds
+    self._redraw_handle = None
 
-    def _need_redraw(): self.need_redraw = True
-    signals.connect('need-redraw', _need_redraw)
+    signals.connect('need-redraw', self._schedule_redraw)
 
     if not self.xs.connected:
       if self.config.autostart_server:
@@ -180,6 +193,16 @@ class Ccx2(object):
         print("error: couldn't connect to server", file=sys.stderr)
         sys.exit(0)
 
+    # on the loop already so setting up can wait for the server state
+    self._xmmsfd = self.xs.xmms.get_fd()
+    loop.add_reader(self._xmmsfd, self._on_xmms_readable)
+    self.xs.xmms.set_need_out_fun(self._on_xmms_need_out)
+    self._on_xmms_need_out(1)
+    loop.wait(self.xs.seeded)
+
+    if self.config.disk_cache and self.config.dir:
+      self.xs.cache.open_disk(os.path.join(self.config.dir, 'medialib.db'))
+
   def run(self):
     self.setup_ui()
 
@@ -187,6 +210,10 @@ class Ccx2(object):
       self.ui.run_wrapper(self.main_loop)
     except KeyboardInterrupt:
       sys.exit(0)
+    finally:
+      # don't lose the writes still waiting to be committed
+      if self.xs.cache.disk is not None:
+        self.xs.cache.disk.commit()
 
   def setup_ui(self):
     self.ui = urwid.curses_display.Screen()
@@ -226,79 +253,115 @@ class Ccx2(object):
         self.ui.curses_pairs.append((j,j))
         self.ui.palette['h%d'%j] = (j+i-16, 0, 0)
 
-    focus_tab = self.xs.playback_status() == xmmsclient.PLAYBACK_STATUS_PLAY and 1 or 2
+    focus_tab = self.xs.state.status == xmmsclient.PLAYBACK_STATUS_PLAY and 1 or 2
 
     self.tabcontainer = containers.TabContainer(self, tabs, focus_tab=focus_tab)
     self.headerbar = HeaderBar(self)
     self.statusarea = StatusArea()
     self.view = urwid.Frame(self.tabcontainer, header=self.headerbar, footer=self.statusarea)
 
-  def notify(self):
-    os.write(self._pipe[1], '\0')
+  def _schedule_redraw(self, region=None):
+    # redraws asked for in between frames are drawn together
+    self._dirty.add(region)
+    if self._redraw_handle is None:
+      wait = self._last_draw + self._frame_interval() - time.time()
+      self._redraw_handle = loop.call_later(max(wait, 0), self._timed_redraw)
 
   def redraw(self):
-    canvas = self.view.render(self.size, focus=1)
+    canvas = None
+    if self._dirty == set(['header']) and self._canvas is not None and \
+       self._canvas.cols() == self.size[0] and self._canvas.rows() == self.size[1]:
+      canvas = self._redraw_header()
+
+    if canvas is None:
+      canvas = self._canvas = self.view.render(self.size, focus=1)
+      self._header_rows = self.headerbar.rows((self.size[0],))
+
     self.ui.draw_screen(self.size, canvas)
-    self.need_redraw = False
+    self._dirty.clear()
+
+  def _frame_interval(self):
+    # a slow terminal or a huge frame gets fewer frames than asked for
+    return max(1.0 / max(self.config.max_fps, 1), self._render_time * 2)
+
+  def _timed_redraw(self):
+    if self._redraw_handle is not None:
+      self._redraw_handle.cancel()
+      self._redraw_handle = None
+
+    start = time.time()
+    self.redraw()
+    self._last_draw = end = time.time()
+    self._render_time = (self._render_time * 3 + end - start) / 4
+
+  def _redraw_header(self):
+    """Put a freshly rendered header on top of the rest of the last frame.
+
+    Only works if the header still takes the same number of rows.
+    """
+    header = self.headerbar.render((self.size[0],))
+    if header.rows() != self._header_rows:
+      return None
+
+    rest = urwid.CompositeCanvas(self._canvas)
+    rest.trim(self._header_rows)
+    return urwid.CanvasCombine([(header, None, False), (rest, None, True)])
 
   def main_loop(self):
     self.size = self.ui.get_cols_rows()
 
-    xmmsfd = self.xs.xmms.get_fd()
-    stdinfd = sys.stdin.fileno()
+    loop.add_reader(sys.stdin.fileno(), self._on_input)
 
-    while True:
-      if self.need_redraw:
-        self.redraw()
+    self._timed_redraw()
+    loop.run()
 
-      input_keys = None
+  def _on_xmms_readable(self):
+    self.xs.ioin()
 
-      w = self.xs.xmms.want_ioout() and [xmmsfd] or []
+    if not self.xs.connected:
+      print("disconnected from server", file=sys.stderr)
+      sys.exit(0) # TODO
 
-      try:
-        (i, o, e) = select.select([xmmsfd, stdinfd, self._pipe[0]], w, [])
-      except select.error:
-        i = [xmmsfd, stdinfd]
-
-      if not self.xs.connected:
-        print("disconnected from server", file=sys.stderr)
-        sys.exit(0) # TODO
-
-      for fd in i:
-        if fd == xmmsfd:
-          self.xs.ioin()
-        elif fd == stdinfd:
-          input_keys = self.ui.get_input()
-        elif fd == self._pipe[0]:
-          os.read(self._pipe[0], 1)
-
-      if o and o[0] == xmmsfd:
-        self.xs.ioout()
-
-      if not input_keys:
-        continue
+  def _on_xmms_need_out(self, i):
+    if self.xs.xmms.want_ioout():
+      loop.add_writer(self._xmmsfd, self._on_xmms_writable)
 
-      self.statusarea.clear_message()
+  def _on_xmms_writable(self):
+    self.xs.ioout()
+    if not self.xs.xmms.want_ioout():
+      loop.remove_writer(self._xmmsfd)
+
+  def _on_input(self):
+    input_keys = self.ui.get_input()
+    if not input_keys:
+      return
 
-      for k in input_keys:
-        if self.show_key:
-          signals.emit('show-message', 'key: %s' % config.urwid_key_to_key(k))
-          self.show_key = False
+    self.statusarea.clear_message()
+
+    for k in input_keys:
+      if self.show_key:
+        signals.emit('show-message', 'key: %s' % config.urwid_key_to_key(k))
+        self.show_key = False
+        continue
+      try:
+        if k == 'window resize':
+          self.size = self.ui.get_cols_rows()
+          signals.emit('window-resized', self.size)
+        elif self.view.keypress(self.size, k) is None:
           continue
-        try:
-          if k == 'window resize':
-            self.size = self.ui.get_cols_rows()
-            signals.emit('window-resized', self.size)
-          elif self.view.keypress(self.size, k) is None:
-            continue
-          elif self.cm.run_key(k, self.view.body.get_contexts() + [self]):
-            continue
-          elif k == ':':
-            self.show_command_prompt()
-          else:
-            signals.emit('show-message', "unbound key: %s" % k, 'error')
-        except commands.CommandError as e:
-          signals.emit('show-message', "command error: %s" % e, 'error')
+        elif self.cm.run_key(k, self.view.body.get_contexts() + [self]):
+          continue
+        elif k == ':':
+          self.show_command_prompt()
+        else:
+          signals.emit('show-message', "unbound key: %s" % k, 'error')
+      except commands.CommandError as e:
+        signals.emit('show-message', "command error: %s" % e, 'error')
+
+    # keys can change anything on screen, and typing shouldn't wait for the
+    # next frame
+    self._dirty.add(None)
+    self._timed_redraw()
 
   def show_dialog(self, dialog):
     return dialog.show(self.ui, self.size, self.view)
@@ -356,8 +419,22 @@ class Ccx2(object):
   def cmd_slow_as_hell(self, args): signals.emit('show-message', 'Indeed!')
 
   def cmd_info(self, args):
-    info = self.xs.playback_current_info()
+    loop.spawn(self._show_info())
+
+  async def _show_info(self):
+    info = await self.xs.playback_current_info(sync=False)
+    if not info:
+      signals.emit('show-message', "nothing is playing", 'error')
+      return
     self.show_dialog(containers.InfoDialog(self, info, self.view.body))
+    signals.emit('need-redraw')
+
+  def cmd_cache_stats(self, args):
+    stats = []
+    for name, (hits, misses, n) in sorted(util.lru_stats().items()):
+      rate = hits * 100 // max(hits + misses, 1)
+      stats.append('%s %d%% of %d (%d kept)' % (name, rate, hits + misses, n))
+    signals.emit('show-message', ', '.join(stats))
 
   def cmd_keycode(self, args):
     signals.emit('show-message', "Press any key to see the config compatible keycode")
@@ -377,7 +454,13 @@ class Ccx2(object):
     except ValueError:
       raise commands.CommandError('bad pattern')
 
-    ids = self.xs.coll_query_ids(c)
+    loop.spawn(self._rehash(c))
+
+  async def _rehash(self, c):
+    try:
+      ids = await self.xs.coll_query_ids(c, sync=False)
+    except xmmsclient.XMMSError:
+      return
 
     for i in ids:
       self.xs.medialib_rehash(i, sync=False)
@@ -402,12 +485,12 @@ class Ccx2(object):
         self.xs.playback_seek_ms(seconds*1000, sync=False)
 
   def cmd_volume(self, args):
-    cur = self.xs.playback_volume_get()
-
-    if isinstance(cur, str):
-      signals.emit('show-message', "volume: "+cur)
+    if self.xs.state.volume is None:
+      signals.emit('show-message', "volume: no volume control")
       return
 
+    cur = dict(self.xs.state.volume)
+
     if args:
       relative = args[0] in ('+', '-')
 
@@ -418,10 +501,10 @@ class Ccx2(object):
 
       for c in cur:
         if relative:
-          cur[c] = cur[c] + volume
+          cur[c] = max(0, min(cur[c] + volume, 100))
         else:
-          cur[c] = volume
-        self.xs.playback_volume_set(c, cur[c])
+          cur[c] = max(0, min(volume, 100))
+        self.xs.playback_volume_set(c, cur[c], sync=False)
 
     s = "volume: " + ' '.join("%s:%d" % (c, v) for c, v in cur.items())
     signals.emit('show-message', s)
@@ -0,0 +1,577 @@
+# Copyright (c) 2008-2009 Pablo Flouret <quuxbaz@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met: Redistributions of
+# source code must retain the above copyright notice, this list of conditions and
+# the following disclaimer. Redistributions in binary form must reproduce the
+# above copyright notice, this list of conditions and the following disclaimer in
+# the documentation and/or other materials provided with the distribution.
+# Neither the name of the software nor the names of its contributors may be
+# used to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import array
+import json
+import sqlite3
+import time
+
+import xmmsclient
+from xmmsclient import collections as coll
+
+from . import loop
+from . import signals
+from . import util
+
+# args -- ids:list
+signals.register('medialib-infos-loaded')
+
+# args -- ids:list
+signals.register('medialib-entries-changed')
+
+# args -- ids:list, asked for but not in the reply, or the query failed
+signals.register('medialib-infos-missing')
+
+
+# fields with few distinct values, stored as indexes into a table of values
+_interned_fields = set(['album', 'albumartist', 'artist', 'channels', 'compilation',
+                        'composer', 'conductor', 'date', 'genre', 'mime',
+                        'partofset', 'performer', 'publisher', 'samplerate',
+                        'status', 'tracknr', 'year'])
+
+# fields that are (usually) integers
+_int_fields = set(['added', 'bitrate', 'duration', 'id', 'laststarted', 'lmod',
+                   'size', 'timesplayed'])
+
+_NOINT = -2**63
+
+
+class ColumnStore(object):
+  """Infos stored one column per field, rows are slots.
+
+  Strings in _interned_fields are kept once in a per-field table and rows
+  only hold their index. Integer fields live in an array('q') as long as
+  everything put in them is an integer.
+  """
+
+  def __init__(self):
+    self._bits = {}     # field => bit in the known mask
+    self._columns = {}  # field => array or list
+    self._tables = {}   # field => (values, value => index)
+    self._known = []    # slot => mask of the fields fetched for it
+    self._mids = array.array('I')
+    self._free = []
+
+  def __len__(self):
+    return len(self._known) - len(self._free)
+
+  def _column(self, field):
+    try:
+      return self._columns[field]
+    except KeyError:
+      pass
+
+    n = len(self._known)
+    self._bits[field] = 1 << len(self._bits)
+    if field in _interned_fields:
+      self._tables[field] = ([None], {})
+      c = array.array('I', [0]) * n
+    elif field in _int_fields:
+      c = array.array('q', [_NOINT]) * n
+    else:
+      c = [None] * n
+    self._columns[field] = c
+    return c
+
+  def alloc(self, mid):
+    if self._free:
+      slot = self._free.pop()
+      self._mids[slot] = mid
+      return slot
+
+    self._known.append(0)
+    self._mids.append(mid)
+    for field, c in self._columns.items():
+      if field in self._tables:
+        c.append(0)
+      elif isinstance(c, array.array):
+        c.append(_NOINT)
+      else:
+        c.append(None)
+    return len(self._known) - 1
+
+  def free(self, slot):
+    for field, c in self._columns.items():
+      if field in self._tables:
+        c[slot] = 0
+      elif isinstance(c, array.array):
+        c[slot] = _NOINT
+      else:
+        c[slot] = None
+    self._known[slot] = 0
+    self._mids[slot] = 0
+    self._free.append(slot)
+
+  def mid(self, slot):
+    return self._mids[slot]
+
+  def set(self, slot, field, value):
+    c = self._column(field)
+
+    if field in self._tables:
+      values, index = self._tables[field]
+      if value is None:
+        i = 0
+      else:
+        i = index.get(value)
+        if i is None:
+          i = index[value] = len(values)
+          values.append(value)
+      c[slot] = i
+    elif isinstance(c, array.array):
+      if value is None:
+        c[slot] = _NOINT
+      elif isinstance(value, int) and _NOINT < value < -_NOINT:
+        c[slot] = value
+      else:
+        # not an int after all, fall back to a list
+        c = self._columns[field] = [None if v == _NOINT else v for v in c]
+        c[slot] = value
+    else:
+      c[slot] = value
+
+    self._known[slot] |= self._bits[field]
+
+  def value(self, slot, field):
+    """Return the value of field, or None if it has none (or isn't known)."""
+    c = self._columns.get(field)
+    if c is None:
+      return None
+
+    if field in self._tables:
+      return self._tables[field][0][c[slot]]
+
+    v = c[slot]
+    if isinstance(c, array.array) and v == _NOINT:
+      return None
+    return v
+
+  def has(self, slot, fields):
+    known = self._known[slot]
+    for f in fields:
+      bit = self._bits.get(f)
+      if bit is None or not known & bit:
+        return False
+    return True
+
+  def known_fields(self, slot):
+    known = self._known[slot]
+    return [f for f, bit in self._bits.items() if known & bit]
+
+
+class Row(object):
+  """Read-only dict-like view over one ColumnStore slot.
+
+  Only valid while the entry is cached, afterwards it behaves as empty.
+  """
+
+  __slots__ = ('_store', '_slot', '_mid')
+
+  def __init__(self, store, slot, mid):
+    self._store = store
+    self._slot = slot
+    self._mid = mid
+
+  def _value(self, key):
+    if self._store.mid(self._slot) != self._mid:
+      return None
+    return self._store.value(self._slot, key)
+
+  def __getitem__(self, key):
+    v = self._value(key)
+    if v is None:
+      raise KeyError(key)
+    return v
+
+  def __contains__(self, key):
+    return self._value(key) is not None
+
+  def get(self, key, default=None):
+    v = self._value(key)
+    if v is None:
+      return default
+    return v
+
+  def keys(self):
+    if self._store.mid(self._slot) != self._mid:
+      return []
+    return [f for f in self._store.known_fields(self._slot) if f in self]
+
+  def __iter__(self):
+    return iter(self.keys())
+
+
+class DiskCache(object):
+  """Projected infos saved in an sqlite database, to survive restarts.
+
+  Rows remember the server they came from and the entry's lmod, so they can
+  be checked against the server when connecting. Writes are committed in
+  batches, commit_delay seconds after the first one.
+  """
+
+  commit_delay = 2.0
+
+  def __init__(self, path, server):
+    self._commit_handle = None
+    self.db = sqlite3.connect(path)
+    self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+    self.db.execute('CREATE TABLE IF NOT EXISTS infos '
+                    '(id INTEGER PRIMARY KEY, lmod INTEGER, info TEXT)')
+
+    r = self.db.execute("SELECT value FROM meta WHERE key = 'server'").fetchone()
+    if r is None or r[0] != server:
+      # ids are meaningless on another server
+      self.db.execute('DELETE FROM infos')
+      self.db.execute("INSERT OR REPLACE INTO meta VALUES ('server', ?)", (server,))
+    self.db.commit()
+
+  def _select(self, ids):
+    ids = list(ids)
+    for i in range(0, len(ids), 500):
+      chunk = ids[i:i+500]
+      q = 'SELECT id, info FROM infos WHERE id IN (%s)' % ','.join('?'*len(chunk))
+      for mid, info in self.db.execute(q, chunk):
+        yield mid, json.loads(info)
+
+  def load(self, ids, fields):
+    """Return the saved infos, out of ids, that have all the fields.
+
+    Fields without a value are saved as None, those are left out.
+    """
+    r = []
+    for mid, info in self._select(ids):
+      if all(f in info for f in fields):
+        r.append(dict((k, v) for k, v in info.items() if v is not None))
+    return r
+
+  def save(self, infos, fields):
+    infos = dict((info['id'], info) for info in infos)
+    saved = dict(self._select(infos))
+
+    rows = []
+    for mid, info in infos.items():
+      # keep whatever other fields were saved before
+      d = saved.get(mid, {})
+      d.update((f, info.get(f)) for f in fields)
+      rows.append((mid, d.get('lmod'), json.dumps(d)))
+
+    self.db.executemany('INSERT OR REPLACE INTO infos VALUES (?, ?, ?)', rows)
+    self._commit_later()
+
+  def remove(self, ids):
+    self.db.executemany('DELETE FROM infos WHERE id = ?', [(mid,) for mid in ids])
+    self._commit_later()
+
+  def _commit_later(self):
+    # a commit syncs to disk, don't pay for it on every screenful of infos
+    if self._commit_handle is None:
+      self._commit_handle = loop.call_later(self.commit_delay, self.commit)
+
+  def commit(self):
+    if self._commit_handle is not None:
+      self._commit_handle.cancel()
+      self._commit_handle = None
+    self.db.commit()
+
+  def lmods(self):
+    return dict(self.db.execute('SELECT id, lmod FROM infos'))
+
+
+class InfoCache(object):
+  """Process-wide cache of medialib infos, keyed by media id.
+
+  Infos are either projections over some fields (coll_query_infos), kept in a
+  ColumnStore, or full PropDicts (medialib_get_info). The cache keeps track of
+  which fields are known for every id so partial infos can be reused for any
+  request they satisfy.
+  """
+
+  disk_check_size = 2000
+
+  def __init__(self, xs, maxsize=50000, maxfull=100):
+    super(InfoCache, self).__init__()
+
+    self.xs = xs
+    self._store = ColumnStore()
+    self._entries = util.LRUDict(maxsize, on_evict=self._evict, name='infos') # id => slot
+    self._full = util.LRUDict(maxfull, name='full infos') # id => PropDict
+    self._pending = {} # id => fields on their way
+    self._waiting = {} # id => callbacks waiting for a full info
+    self._changed = set()
+    self.disk = None
+    self.rtt = 0.05 # seconds, smoothed
+
+    signals.connect('xmms-medialib-entry-changed', self.on_medialib_entry_changed)
+
+  def __contains__(self, mid):
+    return mid in self._entries or mid in self._full
+
+  def _evict(self, mid, slot):
+    self._store.free(slot)
+
+  def get(self, mid, fields=None):
+    """Return the cached info for mid or None if it doesn't have all the fields.
+
+    With fields=None the full PropDict is returned, otherwise a read-only
+    dict-like with (at least) the requested fields that have a value.
+    """
+    if fields is None:
+      return self._full.get(mid)
+
+    slot = self._entries.get(mid)
+    if slot is not None and self._store.has(slot, fields):
+      return Row(self._store, slot, mid)
+
+    full = self._full.get(mid)
+    if full is not None:
+      return dict((key, full[key]) for source, key in full)
+
+    return None
+
+  def missing(self, ids, fields):
+    """Return the ids, out of ids, that don't have all fields cached."""
+    return [mid for mid in ids if self.get(mid, fields) is None]
+
+  def update(self, info, fields):
+    mid = info['id']
+    slot = self._entries.get(mid)
+    if slot is None:
+      slot = self._entries[mid] = self._store.alloc(mid)
+
+    for f in fields:
+      self._store.set(slot, f, info.get(f))
+
+  def update_full(self, info):
+    self._full[info['id']] = info
+
+  def open_disk(self, path):
+    """Back the cache with a DiskCache at path, checked against the server.
+
+    Saved entries are used right away, the ones the server has dropped or
+    that changed on disk since (according to lmod) are thrown out as the
+    check comes back. The check goes disk_check_size ids at a time, one
+    query after the other, so it doesn't hold up anything else for long.
+    """
+    try:
+      self.disk = DiskCache(path, self.xs.path or 'default')
+    except sqlite3.Error:
+      self.disk = None
+      return
+
+    lmods = self.disk.lmods()
+    ids = list(lmods)
+
+    def _check(start):
+      chunk = ids[start:start+self.disk_check_size]
+      if not chunk:
+        return
+
+      def _cb(r):
+        if not r.iserror():
+          current = dict((info['id'], info.get('lmod')) for info in r.value())
+          stale = [mid for mid in chunk
+                   if mid not in current or current[mid] != lmods[mid]]
+          if stale:
+            self.disk.remove(stale)
+            for mid in stale:
+              self.invalidate(mid)
+            signals.emit('medialib-entries-changed', stale)
+
+        _check(start + len(chunk))
+
+      c = coll.IDList()
+      c.ids += chunk
+      self.xs.coll_query_infos(c, ['id', 'lmod'], cb=_cb, sync=False)
+
+    _check(0)
+
+  def invalidate(self, mid):
+    slot = self._entries.pop(mid, None)
+    if slot is not None:
+      self._store.free(slot)
+    self._full.pop(mid, None)
+
+  def on_medialib_entry_changed(self, mid):
+    # rescans and rehashes send these in bursts, handle them all at once
+    if not self._changed:
+      loop.call_soon(self._refresh_changed)
+    self._changed.add(mid)
+
+  def _refresh_changed(self):
+    ids = [mid for mid in self._changed if mid in self]
+    uncached = [mid for mid in self._changed if mid not in self]
+    if self.disk is not None:
+      self.disk.remove(self._changed)
+    self._changed = set()
+
+    # nothing to refetch, but there might be widgets built from them around
+    if uncached:
+      signals.emit('medialib-entries-changed', uncached)
+
+    if not ids:
+      return
+
+    fields = set(['id'])
+    for mid in ids:
+      slot = self._entries.get(mid)
+      if slot is not None:
+        fields.update(self._store.known_fields(slot))
+      full = self._full.get(mid)
+      if full is not None:
+        fields.update(key for source, key in full)
+    fields = list(fields)
+
+    def _cb(r):
+      for mid in ids:
+        self.invalidate(mid)
+
+      if not r.iserror():
+        for info in r.value():
+          self.update(info, fields)
+        if self.disk is not None:
+          self.disk.save(r.value(), fields)
+
+      signals.emit('medialib-entries-changed', ids)
+
+    c = coll.IDList()
+    c.ids += ids
+    self.xs.coll_query_infos(c, fields, cb=_cb, sync=False)
+
+  def fetch(self, ids, fields):
+    """Asynchronously fetch fields for the ids that don't have them cached.
+
+    'medialib-infos-loaded' is emitted with the ids when they arrive.
+    """
+    fields = list(fields)
+    if 'id' not in fields:
+      fields.append('id')
+    if self.disk is not None and 'lmod' not in fields:
+      fields.append('lmod')
+
+    ids = [mid for mid in set(ids)
+           if self.get(mid, fields) is None and
+              not self._pending.get(mid, set()).issuperset(fields)]
+
+    if ids and self.disk is not None:
+      saved = self.disk.load(ids, fields)
+      if saved:
+        for info in saved:
+          self.update(info, fields)
+        # we're likely in the middle of a render, let the walkers know later
+        loop.call_soon(signals.emit, 'medialib-infos-loaded', [i['id'] for i in saved])
+        ids = [mid for mid in ids if self.get(mid, fields) is None]
+
+    if not ids:
+      return
+
+    sent = time.time()
+    for mid in ids:
+      self._pending.setdefault(mid, set()).update(fields)
+
+    def _cb(r):
+      self.rtt = (self.rtt*3 + time.time() - sent) / 4
+
+      for mid in ids:
+        self._pending.pop(mid, None)
+
+      loaded = []
+      if not r.iserror():
+        for info in r.value():
+          self.update(info, fields)
+          loaded.append(info['id'])
+
+        if self.disk is not None:
+          self.disk.save(r.value(), fields)
+
+      if loaded:
+        signals.emit('medialib-infos-loaded', loaded)
+
+      if len(loaded) < len(ids):
+        got = set(loaded)
+        signals.emit('medialib-infos-missing', [mid for mid in ids if mid not in got])
+
+    c = coll.IDList()
+    c.ids += ids
+    self.xs.coll_query_infos(c, fields, cb=_cb, sync=False)
+
+  def get_info(self, mid, fields=None, cb=None, sync=True):
+    """Read-through version of medialib_get_info.
+
+    With fields the info is fetched with coll_query_infos and only has those
+    fields, otherwise it's the full PropDict. The async form calls cb with
+    the info, right away if it's cached, or with {} if it can't be had.
+    """
+    info = self.get(mid, fields)
+    if info is not None:
+      if sync:
+        return info
+      if cb is not None:
+        cb(info)
+      return
+
+    if fields is not None:
+      fields = list(fields)
+      if 'id' not in fields:
+        fields.append('id')
+
+      c = coll.IDList()
+      c.ids.append(mid)
+
+      if sync:
+        for info in self.xs.coll_query_infos(c, fields):
+          self.update(info, fields)
+        return self.get(mid, fields) or {}
+
+      def _cb(r):
+        if not r.iserror():
+          for info in r.value():
+            self.update(info, fields)
+        if cb is not None:
+          cb(self.get(mid, fields) or {})
+      self.xs.coll_query_infos(c, fields, cb=_cb, sync=False)
+      return
+
+    if sync:
+      info = self.xs.medialib_get_info(mid)
+      if type(info) == xmmsclient.PropDict:
+        self.update_full(info)
+      return info
+
+    if mid in self._waiting:
+      if cb is not None:
+        self._waiting[mid].append(cb)
+      return
+
+    self._waiting[mid] = cb is not None and [cb] or []
+
+    def _full_cb(r):
+      cbs = self._waiting.pop(mid, [])
+      info = {}
+      if not r.iserror() and type(r.value()) == xmmsclient.PropDict:
+        info = r.value()
+        self.update_full(info)
+      for f in cbs:
+        f(info)
+    self.xs.medialib_get_info(mid, cb=_full_cb, sync=False)
@@ -30,6 +30,7 @@ import xmmsclient
 
 from . import commands
 from . import containers
+from . import loop
 from . import mif
 from . import signals
 from . import util
@@ -38,10 +39,7 @@ from . import xmms
 
 try:
   from PIL import Image
-  try:
-    from io import StringIO
-  except ImportError:
-    from io import StringIO
+  from io import BytesIO
 except ImportError:
   pass
 
@@ -55,7 +53,9 @@ class NowPlaying(urwid.WidgetWrap):
     self.parser = mif.FormatParser(self.app.config.format(formatname))
     self.ctx = self.info = {}
     self.cur_hash = None
-    self.status = self.xs.playback_status()
+    self._cover_task = None
+    self.on_display = False
+    self.status = self.xs.state.status
     self.time = 0
 
     self.progress = urwid.ProgressBar('progress-normal', 'progress-complete', 0, 100,
@@ -97,11 +97,15 @@ class NowPlaying(urwid.WidgetWrap):
 
     self.song.set_text(self.parser.eval(self.ctx))
 
+    # the clock ticks only redraw the header, the rest has to ask
+    if self.on_display:
+      signals.emit('need-redraw')
+
   def on_xmms_playback_playtime(self, milli):
     if self.show_cover and not self.cur_hash:
       self.cover.reset()
 
-    if self.time/1000 != milli/1000:
+    if self.time//1000 != milli//1000:
       self.time = milli
       self.update()
 
@@ -109,6 +113,14 @@ class NowPlaying(urwid.WidgetWrap):
     self.status = status
     self.update()
 
+  def tab_loaded(self):
+    self.on_display = True
+    self.xs.want_playtime(self)
+
+  def tab_unloaded(self):
+    self.on_display = False
+    self.xs.want_playtime(self, False)
+
   def on_xmms_playback_current_info(self, info):
     self.info = info
     self.ctx = dict(list(zip((k[1] for k in self.info), list(self.info.values()))))
@@ -117,17 +129,28 @@ class NowPlaying(urwid.WidgetWrap):
         # TODO: cache the picture to disk (or open directly from disk if local?)
         hash = self.info['picture_front']
         if hash != self.cur_hash:
-          self.xs.bindata_retrieve(hash, cb=self._set_cover_cb, sync=False)
+          if self._cover_task:
+            self._cover_task.cancel()
+          self._cover_task = loop.spawn(self._load_cover(hash))
           self.cur_hash = hash
       else:
+        if self._cover_task:
+          self._cover_task.cancel()
         self.cover.reset()
         self.cur_hash = None
     self.update()
 
-  def _set_cover_cb(self, r):
-    if not r.iserror():
-      self.cover.set_data(r.value())
-      self._invalidate()
+  async def _load_cover(self, hash):
+    f, cb = xmms.result_future()
+    self.xs.bindata_retrieve(hash, cb=cb, sync=False)
+    try:
+      data = await f
+    except xmmsclient.XMMSError:
+      return
+
+    await self.cover.load(data)
+    self._invalidate()
+    signals.emit('need-redraw')
 
   def cmd_same(self, args):
     fields = args.split()
@@ -150,6 +173,7 @@ class AlbumCoverWidget(urwid.WidgetWrap):
     self.dim = None
     self.step = 0
     self.cheesy_last_animated = 0
+    self._scale_task = None
 
     if data:
       self.set_data(data)
@@ -160,25 +184,42 @@ class AlbumCoverWidget(urwid.WidgetWrap):
     self.__super.__init__(self.filler)
 
   def reset(self):
+    if self._scale_task:
+      self._scale_task.cancel()
     self.dim = None
     self.img = None
     self.text.set_text('')
     self._w = self.filler
     self._invalidate()
 
-  def set_data(self, data):
+  def _decode(self, data):
     try:
-      self.img = Image.open(StringIO(data))
-      if self.img.mode == 'P':
-        self.img = self.img.convert('RGB')
-
-      self.dim = None
-      self.text.align = 'left'
-      self._w = self.padding
-    except IOError as e:
+      img = Image.open(BytesIO(data))
+      if img.mode == 'P':
+        img = img.convert('RGB')
+      img.load()
+      return img
+    except IOError:
+      return None
+
+  def _set_img(self, img):
+    if img is None:
       self.reset()
+      return
+
+    self.img = img
+    self.dim = None
+    self.text.align = 'left'
+    self._w = self.padding
     self._invalidate()
 
+  def set_data(self, data):
+    self._set_img(self._decode(data))
+
+  async def load(self, data):
+    """Like set_data() but decodes the image in a thread."""
+    self._set_img(await loop.in_thread(self._decode, data))
+
   def closest_color(self, rgb):
     global _colormap_cache
 
@@ -236,11 +277,11 @@ class AlbumCoverWidget(urwid.WidgetWrap):
 
     w = min(w, self.img.size[0])
 
-    h = (w/2) * self.img.size[1] / self.img.size[0]
+    h = (w//2) * self.img.size[1] // self.img.size[0]
 
     if len(size) > 1 and h > size[1]:
       h = size[1]
-      w = (h * self.img.size[0] / self.img.size[1])*2
+      w = (h * self.img.size[0] // self.img.size[1])*2
 
     return w, h
 
@@ -248,10 +289,18 @@ class AlbumCoverWidget(urwid.WidgetWrap):
     if self.img:
       dim = self.scaled_dim(size)
       if dim != self.dim:
+        # the old picture stays up until the new size is ready
         self.dim = dim
-        img = self.img.resize(dim, Image.ANTIALIAS)
-        self.text.set_text(self.get_markup(img))
-        self._w.width = dim[0]
+        if self._scale_task:
+          self._scale_task.cancel()
+        self._scale_task = loop.spawn(self._scale(self.img, dim))
     return self._w.render(size)
 
+  async def _scale(self, img, dim):
+    markup = await loop.in_thread(lambda: self.get_markup(img.resize(dim, Image.ANTIALIAS)))
+    self.text.set_text(markup)
+    self._w.width = dim[0]
+    self._invalidate()
+    signals.emit('need-redraw')
+
 
@@ -22,6 +22,8 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import collections
+
 import urwid
 import xmmsclient
 
@@ -30,8 +32,10 @@ from xmmsclient import collections as coll
 from . import collutil
 from . import commands
 from . import listbox
+from . import loop
 from . import mif
 from . import signals
+from . import util
 from . import widgets
 from . import xmms
 
@@ -62,47 +66,94 @@ class RowColumns(urwid.Columns):
       self._invalidate()
 
 
-# FIXME: cleanup all the xmms-playlist-changed mess
-
 class PlaylistWalker(urwid.ListWalker):
-  def __init__(self, pls, format):
-    self.pls = pls
+  def __init__(self, pls, format, max_song_widgets=2000, max_row_widgets=500):
     self.format = format
     self.parser = mif.FormatParser(format)
-    self.song_widgets = {}
-    self.row_widgets = {}
-    self.focus = 0
+    # widgets kept for rows scrolled past
+    self.song_widgets = util.LRUDict(max_song_widgets, name='playlist songs') # mid => SongWidget
+    self.row_widgets = util.LRUDict(max_row_widgets, name='playlist rows') # pos => RowColumns
 
-    self.feeder = collutil.PlaylistFeeder(self.pls, self.parser.fields())
+    self.feeder = collutil.playlist_feeders().acquire(pls, self.parser.fields())
+    self.current_pos = self.feeder.current_pos
+    self._loading = not self.feeder.loaded
 
-    try:
-      self.current_pos = int(self.feeder.collection.attributes.get('position', -1))
-    except ValueError:
-      self.current_pos = -1
+    if self.feeder.focus is None:
+      self.focus = max(self.current_pos, 0)
+    else:
+      self.focus = self.feeder.focus
 
-    signals.connect('xmms-medialib-entry-changed', self.on_medialib_entry_changed)
+    signals.connect('feeder-ids-changed', self.on_feeder_ids_changed)
+    signals.connect('feeder-infos-loaded', self.on_feeder_infos_loaded)
+    signals.connect('medialib-entries-changed', self.on_medialib_entries_changed)
     signals.connect('xmms-playlist-current-pos', self.on_xmms_playlist_current_pos)
-    signals.connect('xmms-playlist-changed', self.on_xmms_playlist_changed)
+
+  # follows renames
+  pls = property(lambda self: self.feeder.name)
+
+  def close(self):
+    """Disconnect from everything and hand the feeder back to the pool."""
+    signals.disconnect('feeder-ids-changed', self.on_feeder_ids_changed)
+    signals.disconnect('feeder-infos-loaded', self.on_feeder_infos_loaded)
+    signals.disconnect('medialib-entries-changed', self.on_medialib_entries_changed)
+    signals.disconnect('xmms-playlist-current-pos', self.on_xmms_playlist_current_pos)
+    collutil.playlist_feeders().release(self.feeder)
+
+  def nbytes(self):
+    """Rough amount of memory held by the walker, the feeder is the pool's."""
+    return len(self.song_widgets) * 1536 + len(self.row_widgets) * 1024
 
   def __len__(self):
     return len(self.feeder)
 
-  def on_medialib_entry_changed(self, mid):
-    if mid in self.song_widgets:
+  def on_feeder_infos_loaded(self, feeder, ids):
+    if feeder is not self.feeder:
+      return
+
+    loaded = set(ids)
+    for mid in loaded:
+      if isinstance(self.song_widgets.peek(mid), widgets.PlaceholderSongWidget):
+        del self.song_widgets[mid]
+
+    for pos, w in list(self.row_widgets.items()):
+      if w.mid in loaded:
+        del self.row_widgets[pos]
+
+    self._modified()
+    signals.emit('need-redraw')
+
+  def on_medialib_entries_changed(self, ids):
+    changed = set(ids)
+    rows = [pos for pos, w in self.row_widgets.items() if w.mid in changed]
+    songs = [mid for mid in changed if mid in self.song_widgets]
+    if not rows and not songs:
+      return
+
+    for mid in songs:
       del self.song_widgets[mid]
-      for pos in self.feeder.id_positions(mid):
-        try:
-          del self.row_widgets[pos]
-        except KeyError:
-          pass
-      signals.emit('need-redraw')
 
-  def on_xmms_playlist_changed(self, pls, type, id, pos, newpos):
-    if pls != self.pls:
+    for pos in rows:
+      del self.row_widgets[pos]
+
+    self._modified()
+    signals.emit('need-redraw')
+
+  def on_feeder_ids_changed(self, feeder, types):
+    if feeder is not self.feeder:
       return
 
-    if type != xmmsclient.PLAYLIST_CHANGED_ADD:
-      self.row_widgets = {}
+    if self._loading:
+      # start at the current song once the playlist is in
+      self._loading = False
+      self.current_pos = self.feeder.current_pos
+      if self.focus <= 0:
+        self.focus = max(self.current_pos, 0)
+
+    # song widgets are per id so they're still good, rows only need to go if
+    # a different song ended up in their position
+    for pos, w in list(self.row_widgets.items()):
+      if self.feeder.position_id(pos) != w.mid:
+        del self.row_widgets[pos]
 
     self.set_focus(self.focus)
     signals.emit('need-redraw')
@@ -118,18 +169,29 @@ class PlaylistWalker(urwid.ListWalker):
     if pos < 0 or mid is None:
       return None, None
 
-    if mid not in self.song_widgets:
-      text = self.parser.eval(self.feeder[pos])
-      self.song_widgets[mid] = widgets.SongWidget(mid, text)
-
-    try:
-      w = self.row_widgets[pos]
+    w = self.row_widgets.get(pos)
+    if w is not None and w.mid == mid and not self._stale(w.song_w):
       w.set_pos(pos, len(self.feeder))
-    except KeyError:
-      w = self.row_widgets[pos] = RowColumns(self.song_widgets[mid], pos, len(self.feeder))
+      return w, pos
+
+    song_w = self.song_widgets.get(mid)
+    if song_w is None or self._stale(song_w):
+      info = self.feeder[pos]
+      if info is None:
+        song_w = widgets.PlaceholderSongWidget(mid)
+      else:
+        song_w = widgets.SongWidget(mid, self.parser.eval(info))
+      self.song_widgets[mid] = song_w
+
+    w = self.row_widgets[pos] = RowColumns(song_w, pos, len(self.feeder))
 
     return w, pos
 
+  def _stale(self, song_w):
+    # a placeholder whose info came in without us hearing about it
+    return isinstance(song_w, widgets.PlaceholderSongWidget) and \
+           self.feeder.get_info(song_w.mid) is not None
+
   def set_focus(self, focus):
     if focus <= 0:
       focus = 0
@@ -137,6 +199,7 @@ class PlaylistWalker(urwid.ListWalker):
       focus = len(self.feeder) - 1
 
     self.focus = focus
+    self.feeder.set_cursor(focus)
     self._modified()
 
   def focus_current_pos(self):
@@ -148,6 +211,61 @@ class PlaylistWalker(urwid.ListWalker):
   def get_next(self, pos): return self.get_pos(pos+1)
 
 
+class WalkerCache(object):
+  """Recently viewed PlaylistWalkers, kept within a memory budget.
+
+  The budget is shared with the feeder pool. Walkers going over it are
+  closed, least recently viewed first, and built again from their pooled
+  feeder next time they're needed.
+  """
+
+  def __init__(self, format, feeders, max_song_widgets, max_row_widgets):
+    self.format = format
+    self.feeders = feeders
+    self.max_song_widgets = max_song_widgets
+    self.max_row_widgets = max_row_widgets
+    self._walkers = collections.OrderedDict() # pls => walker
+
+  def get(self, pls):
+    try:
+      walker = self._walkers.pop(pls)
+    except KeyError:
+      walker = PlaylistWalker(pls, self.format,
+                              self.max_song_widgets, self.max_row_widgets)
+    self._walkers[pls] = walker
+    self.trim()
+    return walker
+
+  def release(self, walker):
+    """walker went out of view, check the budget with what it grew to."""
+    self.trim()
+
+  def trim(self):
+    # widgets are cheaper to rebuild than feeders, they go first
+    widgets = sum(w.nbytes() for w in self._walkers.values())
+    while widgets + self.feeders.nbytes() > self.feeders.budget and \
+          len(self._walkers) > 1:
+      pls, walker = self._walkers.popitem(last=False)
+      widgets -= walker.nbytes()
+      self.feeders.reserved = widgets
+      walker.close()
+
+    self.feeders.reserved = widgets
+    self.feeders.trim()
+
+  def rename(self, pls, newname):
+    try:
+      self._walkers[newname] = self._walkers.pop(pls)
+    except KeyError:
+      pass
+
+  def remove(self, pls):
+    try:
+      self._walkers.pop(pls).close()
+    except KeyError:
+      pass
+
+
 class Playlist(listbox.SongListBox):
   context_name = 'playlist'
 
@@ -158,10 +276,18 @@ class Playlist(listbox.SongListBox):
 
     self.format = 'playlist'
 
-    self._walkers = {} # pls => walker
-    self.active_pls = self.xs.playlist_current_active()
+    self.active_pls = self.xs.state.active_playlist
     self.view_pls = self.active_pls
 
+    # the pool has to see renames before we do
+    feeders = collutil.playlist_feeders()
+    feeders.budget = self.app.config.playlist_cache_size*1024*1024
+
+    self._walkers = WalkerCache(self.app.config.format(self.format), feeders,
+                                self.app.config.playlist_song_widgets,
+                                self.app.config.playlist_row_widgets)
+
+    signals.connect('feeder-ids-changed', self.on_feeder_ids_changed)
     signals.connect('xmms-collection-changed', self.on_xmms_collection_changed)
     signals.connect('xmms-playlist-loaded', self.load)
     signals.connect('xmms-playlist-changed', self.on_xmms_playlist_changed)
@@ -170,17 +296,16 @@ class Playlist(listbox.SongListBox):
     self.load(self.active_pls)
 
   def load(self, pls, from_xmms=True):
-    focus_active = False
-    if pls not in self._walkers:
-      self._walkers[pls] = PlaylistWalker(pls, self.app.config.format(self.format))
-      focus_active = True
-
-    self._set_active_attr(self.body.current_pos, self._walkers[pls].current_pos)
+    # rebuilding an evicted walker is cheap, the pooled feeder has the ids and
+    # the focus
+    walker = self._walkers.get(pls)
+    if walker is not self.body:
+      self._set_active_attr(self.body.current_pos, walker.current_pos)
 
-    self.body = self._walkers[pls]
-
-    if focus_active:
-      self.set_focus(self.body.current_pos)
+      prev, self.body = self.body, walker
+      self.set_focus(walker.focus)
+      if isinstance(prev, PlaylistWalker):
+        self._walkers.release(prev)
 
     if from_xmms:
       self.active_pls = pls
@@ -191,23 +316,39 @@ class Playlist(listbox.SongListBox):
   def on_xmms_collection_changed(self, pls, type, namespace, newname):
     if namespace == 'Playlists':
       if type == xmmsclient.COLLECTION_CHANGED_RENAME:
-        try:
-          del self._walkers[pls]
-          if pls == self.active_pls:
-            self.load(newname)
-        except KeyError:
-          pass
+        # the walker's feeder was renamed by the pool already
+        self._walkers.rename(pls, newname)
+        if pls == self.active_pls:
+          self.active_pls = newname
+        if pls == self.view_pls:
+          self.view_pls = newname
         signals.emit('need-redraw')
+      elif type == xmmsclient.COLLECTION_CHANGED_REMOVE:
+        if pls == self.view_pls and pls != self.active_pls:
+          # nothing left to look at, go back to the active playlist
+          self.load(self.active_pls, from_xmms=False)
+        self._walkers.remove(pls)
+
+  def on_feeder_ids_changed(self, feeder, types):
+    # the walker has been filled in, highlight the current song
+    if feeder is self.body.feeder and not types:
+      self._set_active_attr(None, feeder.current_pos)
+      self._invalidate()
 
-  def on_xmms_playlist_changed(self, pls, type, id, pos, newpos):
-    try:
-      # FIXME
-      if pos is None:
-        del self._walkers[pls]
-        if pls == self.active_pls:
-          self.load(pls, from_xmms=False)
-    except KeyError:
-      pass
+  def on_xmms_playlist_changed(self, pls, type, mid, pos, newpos):
+    if pls != self.view_pls:
+      return
+
+    # keep marks and highlights on the entries they were on
+    if type in (xmmsclient.PLAYLIST_CHANGED_ADD, xmmsclient.PLAYLIST_CHANGED_INSERT):
+      self.insert_rows(pos)
+    elif type == xmmsclient.PLAYLIST_CHANGED_REMOVE:
+      self.remove_rows(pos)
+    elif type == xmmsclient.PLAYLIST_CHANGED_MOVE:
+      self.move_row(pos, newpos)
+    else:
+      # clear, sort, shuffle, etc. the current position gets updated anyway
+      self.unmark_all()
 
   def on_xmms_playlist_current_pos(self, pls, pos):
     if pls != self.active_pls:
@@ -234,7 +375,7 @@ class Playlist(listbox.SongListBox):
     else:
       pos = self.get_focus()[1]
     if pos is not None:
-      self.xs.playlist_play(playlist=self.view_pls, pos=pos)
+      self.xs.playlist_play(playlist=self.view_pls, pos=pos, sync=False)
 
   def cmd_goto(self, args):
     if args == 'playing':
@@ -246,15 +387,20 @@ class Playlist(listbox.SongListBox):
         return commands.CONTINUE_RUNNING_COMMANDS
       self.set_focus(p)
 
-  def cmd_rm(self, args):
-    m = self.marked_data
-    if not m:
-      w, pos = self.get_focus()
-      if pos is None:
-        return
-      m = {pos: self.get_mark_data(pos, w)}
+  def _marked_positions(self, reverse=False):
+    """The marked positions, or the focused one if nothing is marked."""
+    if not self._marks:
+      pos = self.get_focus()[1]
+      return pos is not None and [pos] or []
+
+    ranges = list(self._marks.ranges())
+    if reverse:
+      return [pos for start, end, data in reversed(ranges)
+                  for pos in range(end-1, start-1, -1)]
+    return [pos for start, end, data in ranges for pos in range(start, end)]
 
-    for pos, w in sorted(list(m.items()), key=lambda e: e[0], reverse=True):
+  def cmd_rm(self, args):
+    for pos in self._marked_positions(reverse=True):
       self.xs.playlist_remove_entry(pos, self.view_pls, sync=False)
 
     self.unmark_all()
@@ -276,36 +422,24 @@ class Playlist(listbox.SongListBox):
     else:
       self.move_abs(n)
 
-  def _get_marked_for_move(self, reverse=False):
-    m = list(self.marked_data.items())
-    if not m:
-      w, pos = self.get_focus()
-      if pos is None:
-        return
-      m = [(pos, self.get_mark_data(pos, w))]
-
-    m.sort(key=lambda e: e[0], reverse=reverse)
-
-    return m
-
   def move_abs(self, n, m=None):
-    m = self._get_marked_for_move()
+    m = self._marked_positions()
 
     if not m:
       return
 
     n -= 1
-    if n > m[0][0]:
-      self.move_down(n-m[0][0], reversed(m))
+    if n > m[0]:
+      self.move_down(n-m[0], reversed(m))
     else:
-      self.move_up(m[0][0]-n, m)
+      self.move_up(m[0]-n, m)
 
   def move_up(self, n, m=None):
     if m is None:
-      m = self._get_marked_for_move()
+      m = self._marked_positions()
 
     top = 0
-    for pos, mid in m:
+    for pos in m:
       dest = pos - n
 
       if dest < top:
@@ -313,19 +447,17 @@ class Playlist(listbox.SongListBox):
         top += 1
 
       self.xs.playlist_move(pos, dest, sync=False)
-      if not self.marked_data: # moving only the focused song
+      # marks follow the move when the server tells us about it
+      if not self._marks: # moving only the focused song
         self.set_focus(dest)
-      else:
-        self.toggle_mark(pos, mid)
-        self.toggle_mark(dest, mid)
         # TODO: scroll if moving past first row in view
 
   def move_down(self, n, m=None):
     if m is None:
-      m = self._get_marked_for_move(reverse=True)
+      m = self._marked_positions(reverse=True)
 
     bottom = len(self.body)-1
-    for pos, mid in m:
+    for pos in m:
       dest = pos+n
 
       if dest > bottom:
@@ -333,22 +465,21 @@ class Playlist(listbox.SongListBox):
         bottom -= 1
 
       self.xs.playlist_move(pos, dest, sync=False)
-      if not self.marked_data: # moving only the focused song
+      # marks follow the move when the server tells us about it
+      if not self._marks: # moving only the focused song
         self.set_focus(dest)
-      else:
-        self.toggle_mark(pos, mid)
-        self.toggle_mark(dest, mid)
         # TODO: scroll if moving past last row in view
 
-  def get_mark_data(self, pos, w):
-    return w.mid
+  def match_collection(self):
+    # the feeder's copy of the playlist could be outdated
+    return coll.Reference(self.view_pls, 'Playlists')
 
   def get_contexts(self):
     return [self]
 
   def _set_active_attr(self, prevpos, newpos):
-    if prevpos != -1:
-      self.remove_row_attr(prevpos, 'active')
+    # prevpos may have been shifted around by playlist changes since
+    self.attr_map('active').clear()
 
     if newpos != -1:
       self.add_row_attr(newpos, 'active')
@@ -371,7 +502,7 @@ class PlaylistSwitcherWalker(urwid.ListWalker):
     return self.nplaylists
 
   def _load(self):
-    self.playlists = [p for p in sorted(self.xs.playlist_list()) if not p.startswith('_')]
+    self.playlists = [p for p in sorted(self.xs.state.playlists) if not p.startswith('_')]
     self.nplaylists = len(self.playlists)
 
   def _reload(self):
@@ -431,7 +562,7 @@ class PlaylistSwitcher(listbox.MarkableListBox):
 
     self.xs = xmms.get()
     self.app = app
-    self.cur_active = self.xs.playlist_current_active()
+    self.cur_active = self.xs.state.active_playlist
     self.active_pos = 0
     self._set_active_attr(None, self.cur_active)
 
@@ -480,15 +611,18 @@ class PlaylistSwitcher(listbox.MarkableListBox):
       # this awfulness stems from the fact that you have to use playlist_add_collection,
       # but collections in the playlist namespace don't have order, doh
       # coll2.0 should fix this mess
-      idl = coll.IDList()
-      cur_active = self.xs.playlist_current_active()
-      ids_from = self.xs.playlist_list_entries(w.name, 'Playlists')
-      ids_to = self.xs.playlist_list_entries(cur_active, 'Playlists')
+      loop.spawn(self._insert(w.name))
+
+  async def _insert(self, name):
+    cur_active = self.xs.state.active_playlist
+    ids_from = await self.xs.playlist_list_entries(name, sync=False)
+    ids_to = await self.xs.playlist_list_entries(cur_active, sync=False)
 
-      for id in ids_to+ids_from:
-        idl.ids.append(id)
+    idl = coll.IDList()
+    for id in ids_to+ids_from:
+      idl.ids.append(id)
 
-      self.xs.coll_save(idl, cur_active, 'Playlists')
+    self.xs.coll_save(idl, cur_active, 'Playlists', sync=False)
 
   def cmd_rm(self, args):
     w = self.get_focus()[0]
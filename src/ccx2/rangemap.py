@@ -0,0 +1,351 @@
+# Copyright (c) 2008-2009 Pablo Flouret <quuxbaz@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met: Redistributions of
+# source code must retain the above copyright notice, this list of conditions and
+# the following disclaimer. Redistributions in binary form must reproduce the
+# above copyright notice, this list of conditions and the following disclaimer in
+# the documentation and/or other materials provided with the distribution.
+# Neither the name of the software nor the names of its contributors may be
+# used to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import bisect
+
+
+class RangeMap(object):
+  """Values attached to ranges of positions, following inserts and removes.
+
+  The ranges are kept as runs in slots of (gap, length, value), gap being the
+  distance from the end of the previous slot, with gap+length of every slot
+  in a Fenwick tree. A slot with no length holds no run, only its gap. Every
+  run is laid out with such a free slot after it, for splits to take.
+
+  Setting or clearing a range, inserting and removing positions only rewrite
+  the slots around it, in O(k log r) for r runs and k slots touched. Runs of
+  equal value that touch are merged. When there isn't a free slot where one
+  is needed the slots are laid out again, O(r), which leaves room for the
+  next splits.
+  """
+
+  def __init__(self):
+    self._layout([])
+
+  def __len__(self):
+    """Number of positions with a value."""
+    return self._count
+
+  def __bool__(self):
+    return self._count > 0
+
+  def __contains__(self, pos):
+    return self._find(pos) is not None
+
+  def get(self, pos, default=None):
+    i = self._find(pos)
+    if i is None:
+      return default
+    return self._values[i]
+
+  def ranges(self):
+    """Iterate over (start, end, value) for every run, in order."""
+    start = 0
+    for gap, length, value in zip(self._gaps, self._lens, self._values):
+      start += gap
+      if length:
+        yield start, start + length, value
+      start += length
+
+  def positions(self):
+    for start, end, value in self.ranges():
+      for pos in range(start, end):
+        yield pos, value
+
+  def set(self, start, end, value=True):
+    """Give every position in [start, end) value."""
+    if start < end:
+      self._replace(start, end, [(start, end, value)])
+
+  def update(self, runs):
+    """Set the values of sorted, non overlapping (start, end, value) runs.
+
+    Lots of runs are done in a single pass over all of them.
+    """
+    new = [r for r in runs if r[0] < r[1]]
+    if len(new) > 8:
+      self._rewrite(new)
+    else:
+      for r in new:
+        self._replace(r[0], r[1], [r])
+
+  def discard(self, start, end):
+    """Remove the values of the positions in [start, end)."""
+    if start < end:
+      self._replace(start, end, [])
+
+  def clear(self):
+    self._layout([])
+
+  def insert(self, pos, n=1):
+    """Make room for n positions at pos, later positions move up by n.
+
+    A run going over pos gets split, the new positions have no value.
+    """
+    i, off = self._locate(pos)
+    if i == len(self._gaps) or n <= 0:
+      return
+
+    gaps, lens = self._gaps, self._lens
+    if off <= gaps[i]:
+      gaps[i] += n
+      self._update(i, n)
+    elif i + 1 < len(gaps) and gaps[i+1] == 0 and lens[i+1] == 0:
+      # the tail goes into the free slot after it
+      tail = gaps[i] + lens[i] - off
+      lens[i] -= tail
+      self._update(i, -tail)
+      gaps[i+1], lens[i+1], self._values[i+1] = n, tail, self._values[i]
+      self._update(i+1, n + tail)
+    else:
+      runs = []
+      for s, e, v in self.ranges():
+        if e <= pos:
+          runs.append((s, e, v))
+        elif s >= pos:
+          runs.append((s + n, e + n, v))
+        else:
+          runs.append((s, pos, v))
+          runs.append((pos + n, e + n, v))
+      self._layout(runs)
+
+  def remove(self, pos, n=1):
+    """Drop the n positions starting at pos, later positions move down."""
+    i, off = self._locate(pos)
+    gaps, lens = self._gaps, self._lens
+    left = n
+    while left > 0 and i < len(gaps):
+      from_gap = min(left, max(gaps[i] - off, 0))
+      from_run = min(left - from_gap, gaps[i] + lens[i] - max(off, gaps[i]))
+      gaps[i] -= from_gap
+      lens[i] -= from_run
+      self._count -= from_run
+      if from_run and not lens[i]:
+        self._values[i] = None
+      self._update(i, -from_gap - from_run)
+      left -= from_gap + from_run
+      i, off = i + 1, 0
+
+    # whatever was on both sides of the hole may be the same run now
+    if pos > 0:
+      a, b = self._find(pos - 1), self._find(pos)
+      if a is not None and b is not None and self._values[a] == self._values[b]:
+        start = self._offset(a) + gaps[a]
+        end = self._offset(b) + gaps[b] + lens[b]
+        self._replace(start, end, [(start, end, self._values[a])])
+
+  def move(self, pos, newpos):
+    """Follow the entry at pos being moved to newpos."""
+    value = self.get(pos)
+    self.remove(pos)
+    self.insert(newpos)
+    if value is not None:
+      self.set(newpos, newpos + 1, value)
+
+  def _replace(self, start, end, new):
+    """Make the sorted runs in new the only ones within [start, end).
+
+    Rewrites the slots from the one holding start to the one holding end-1,
+    along with runs touching the range so they can be merged into the new
+    ones. Lays everything out again if that isn't enough slots.
+    """
+    gaps, lens, values = self._gaps, self._lens, self._values
+    nslots = len(gaps)
+
+    lo = self._locate(start)[0]
+    hi = self._locate(end - 1)[0]
+    if start > 0:
+      q = self._find(start - 1)
+      if q is not None:
+        lo = q
+    q = self._find(end)
+    if q is not None:
+      hi = q
+    # both are the number of slots when past the last one
+    hi = min(hi, nslots - 1)
+
+    base = self._offset(lo)
+    old = []
+    pos = base
+    for i in range(lo, hi + 1):
+      pos += gaps[i]
+      if lens[i]:
+        old.append((pos, pos + lens[i], values[i]))
+      pos += lens[i]
+    region_end = pos
+
+    runs = []
+    for s, e, v in old:
+      if s < start:
+        runs.append((s, min(e, start), v))
+      if e > end:
+        runs.append((max(s, end), e, v))
+    runs.extend(new)
+    runs.sort(key=lambda r: r[0])
+
+    slots = []
+    last = base
+    for s, e, v in runs:
+      if slots and s == last and slots[-1][2] == v:
+        slots[-1][1] += e - s
+      else:
+        slots.append([s - last, e - s, v])
+      last = e
+
+    # runs only go past the region at the end, where there's nothing after
+    if last < region_end:
+      slots.append([region_end - last, 0, None])
+
+    room = max(hi - lo + 1, 0)
+    k = lo + room
+    while len(slots) > room and k < nslots and gaps[k] == 0 and not lens[k]:
+      room += 1
+      k += 1
+    if len(slots) > room:
+      if k < nslots:
+        self._rewrite(new, start, end)
+        return
+      # at the end, just add slots, with a free one to spare
+      for i in range(len(slots) - room + 1):
+        self._append_free()
+      room = len(slots) + 1
+
+    while len(slots) < room:
+      slots.append([0, 0, None])
+    for i, (gap, length, value) in enumerate(slots, lo):
+      self._count += length - lens[i]
+      self._update(i, gap + length - gaps[i] - lens[i])
+      gaps[i], lens[i], values[i] = gap, length, value
+
+  def _rewrite(self, new, start=None, end=None):
+    """Lay out again with the sorted runs in new set, on top of [start, end)
+    being cleared if given."""
+    if start is not None:
+      cut = [(s, e) for s, e, v in new] + [(start, end)]
+    else:
+      cut = [(s, e) for s, e, v in new]
+    cut.sort()
+    starts = [c[0] for c in cut]
+
+    kept = []
+    for s, e, v in self.ranges():
+      # the parts of the run not covered by the cut ones
+      i = max(bisect.bisect_right(starts, s) - 1, 0)
+      cur = s
+      while cur < e:
+        while i < len(cut) and cut[i][1] <= cur:
+          i += 1
+        if i == len(cut) or cut[i][0] >= e:
+          kept.append((cur, e, v))
+          break
+        if cut[i][0] > cur:
+          kept.append((cur, cut[i][0], v))
+        cur = max(cur, cut[i][1])
+        i += 1
+
+    kept.extend(new)
+    kept.sort(key=lambda r: r[0])
+    self._layout(kept)
+
+  def _layout(self, runs):
+    """Lay out the sorted, non overlapping (start, end, value) runs in fresh
+    slots, each one followed by a free slot."""
+    gaps, lens, values = [], [], []
+    self._count = 0
+    last = 0
+    for s, e, v in runs:
+      if lens and s == last and values[-2] == v:
+        lens[-2] += e - s
+      else:
+        gaps.extend((s - last, 0))
+        lens.extend((e - s, 0))
+        values.extend((v, None))
+      self._count += e - s
+      last = e
+
+    n = len(gaps)
+    tree = [0] * (n + 1)
+    for i in range(n):
+      j = i + 1
+      tree[j] += gaps[i] + lens[i]
+      k = j + (j & -j)
+      if k <= n:
+        tree[k] += tree[j]
+
+    self._gaps, self._lens, self._values = gaps, lens, values
+    self._tree = tree
+    self._topbit = n and 1 << (n.bit_length() - 1)
+
+  def _append_free(self):
+    gaps, tree = self._gaps, self._tree
+    gaps.append(0)
+    self._lens.append(0)
+    self._values.append(None)
+    j = len(gaps)
+    # the new node sums the slots (j - lowbit(j), j], the last one being empty
+    tree.append(self._offset(j - 1) - self._offset(j - (j & -j)))
+    if j >= self._topbit * 2:
+      self._topbit = 1 << (j.bit_length() - 1)
+
+  def _update(self, i, delta):
+    if not delta:
+      return
+    tree = self._tree
+    i += 1
+    while i < len(tree):
+      tree[i] += delta
+      i += i & -i
+
+  def _offset(self, i):
+    """Position where slot i starts, gap included."""
+    tree = self._tree
+    s = 0
+    while i > 0:
+      s += tree[i]
+      i -= i & -i
+    return s
+
+  def _locate(self, pos):
+    """Return (slot, offset into its gap+length) for pos.
+
+    The slot is the number of slots if pos is past the last one.
+    """
+    tree = self._tree
+    i, bit = 0, self._topbit
+    while bit:
+      j = i + bit
+      if j < len(tree) and tree[j] <= pos:
+        i = j
+        pos -= tree[j]
+      bit >>= 1
+    return i, pos
+
+  def _find(self, pos):
+    if pos < 0:
+      return None
+    i, off = self._locate(pos)
+    if i < len(self._gaps) and off >= self._gaps[i]:
+      return i
+    return None
@@ -22,9 +22,9 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import asyncio
 import os
 import re
-import threading
 import time
 
 import urwid
@@ -34,37 +34,71 @@ from . import collutil
 from . import config
 from . import commands
 from . import listbox
+from . import loop
 from . import mif
 from . import signals
+from . import util
 from . import widgets
 from . import xmms
 
 
 class SearchWalker(urwid.ListWalker):
-  def __init__(self, collection, format):
+  def __init__(self, collection, format, max_widgets=2000):
     self.format = format
     self.parser = mif.FormatParser(format)
-    self.widgets = {}
+    # widgets kept for rows scrolled past
+    self.widgets = util.LRUDict(max_widgets, name='search songs') # mid => SongWidget
     self.focus = 0
 
     self.feeder = collutil.CollectionFeeder(collection, self.parser.fields())
 
-    signals.connect('xmms-medialib-entry-changed', self.on_medialib_entry_changed)
+    signals.connect('feeder-ids-changed', self.on_feeder_ids_changed)
+    signals.connect('feeder-infos-loaded', self.on_feeder_infos_loaded)
+    signals.connect('medialib-entries-changed', self.on_medialib_entries_changed)
 
   def __len__(self):
     return len(self.feeder)
 
+  def on_feeder_infos_loaded(self, feeder, ids):
+    if feeder is not self.feeder:
+      return
+
+    for mid in ids:
+      if isinstance(self.widgets.peek(mid), widgets.PlaceholderSongWidget):
+        del self.widgets[mid]
+
+    self._modified()
+    signals.emit('need-redraw')
+
+  def on_feeder_ids_changed(self, feeder, types):
+    if feeder is not self.feeder:
+      return
+
+    # the results of a new query are in
+    self.set_focus(self.focus)
+    signals.emit('need-redraw')
+
   def get_pos(self, pos):
     mid = self.feeder.position_id(pos)
 
     if pos < 0 or mid is None:
       return None, None
 
-    if mid not in self.widgets:
-      text = self.parser.eval(self.feeder[pos])
-      self.widgets[mid] = widgets.SongWidget(mid, text)
+    w = self.widgets.get(mid)
+    if w is None or self._stale(w):
+      info = self.feeder[pos]
+      if info is None:
+        w = widgets.PlaceholderSongWidget(mid)
+      else:
+        w = widgets.SongWidget(mid, self.parser.eval(info))
+      self.widgets[mid] = w
+
+    return w, pos
 
-    return self.widgets[mid], pos
+  def _stale(self, w):
+    # placeholders normally go on 'feeder-infos-loaded', in case that was missed
+    return isinstance(w, widgets.PlaceholderSongWidget) and \
+           self.feeder.get_info(w.mid) is not None
 
   def set_focus(self, focus):
     if focus <= 0:
@@ -73,25 +107,34 @@ class SearchWalker(urwid.ListWalker):
       focus = len(self.feeder) - 1
 
     self.focus = focus
+    self.feeder.set_cursor(focus)
     self._modified()
 
   def clear_cache(self):
-    self.widgets = {}
+    self.widgets.clear()
 
   def set_focus_last(self): self.set_focus(len(self.feeder)-1)
   def get_focus(self): return self.get_pos(self.focus)
   def get_prev(self, pos): return self.get_pos(pos-1)
   def get_next(self, pos): return self.get_pos(pos+1)
 
-  def on_medialib_entry_changed(self, mid):
-    if mid in self.widgets:
-      del self.widgets[mid]
+  def on_medialib_entries_changed(self, ids):
+    changed = False
+    for mid in ids:
+      if mid in self.widgets:
+        del self.widgets[mid]
+        changed = True
+
+    if changed:
+      self._modified()
+      signals.emit('need-redraw')
 
 
 class SearchListBox(listbox.SongListBox):
   def __init__(self, formatname, app):
     self.format = formatname
-    self.walker = SearchWalker(coll.IDList(), app.config.format('search'))
+    self.walker = SearchWalker(coll.IDList(), app.config.format('search'),
+                               app.config.search_widgets)
 
     self.__super.__init__(app, self.walker)
 
@@ -102,6 +145,12 @@ class SearchListBox(listbox.SongListBox):
 
   collection = property(lambda self: self.walker.feeder.collection, _set_collection)
 
+  def marked_collection(self):
+    # no need to send the whole result over
+    if self.all_marked():
+      return self.collection
+    return self.__super.marked_collection()
+
   def keypress(self, size, key):
     k = self.__super.keypress(size, key)
     if k in ('up', 'down'):
@@ -130,8 +179,7 @@ class Search(urwid.Pile):
 
     self.prev_q = ''
 
-    self.lock = threading.RLock()
-    self._timer = None
+    self._query_task = None
 
     self.__super.__init__([('flow', urwid.AttrWrap(self.input, 'searchinput')), self.lb], 0)
 
@@ -178,27 +226,26 @@ class Search(urwid.Pile):
     self.input.set_caption(caption)
 
   def process_query(self, q):
-    try:
-      self.lock.acquire()
-      caption = 'quick search: '
-      if q:
-        if coll_parser_pattern_rx.search(q):
-          caption = 'pattern search: '
-        else:
-          q = ' '.join(['~'+s for s in q.split()])
+    if self._query_task:
+      self._query_task.cancel()
+      self._query_task = None
+
+    caption = 'quick search: '
+    if q:
+      if coll_parser_pattern_rx.search(q):
+        caption = 'pattern search: '
       else:
-        self.lb.walker.clear_cache()
+        q = ' '.join(['~'+s for s in q.split()])
+    else:
+      self.lb.walker.clear_cache()
 
-      try:
-        self.lb.collection = coll.coll_parse(q)
-      except ValueError:
-        signals.emit('show-message', "bad pattern", 'error')
+    try:
+      self.lb.collection = coll.coll_parse(q)
+    except ValueError:
+      signals.emit('show-message', "bad pattern", 'error')
 
-      self.input.set_caption(caption)
-      signals.emit('need-redraw')
-      self.app.notify()
-    finally:
-      self.lock.release()
+    self.input.set_caption(caption)
+    signals.emit('need-redraw')
 
   def _on_done(self, widget, q):
     if not self.app.config.search_find_as_you_type:
@@ -211,12 +258,17 @@ class Search(urwid.Pile):
   def _on_query_change(self, widget, q):
     if self.app.config.search_find_as_you_type:
       if q != self.prev_q:
-        if self._timer:
-          self._timer.cancel()
-        self._timer = threading.Timer(0.25, lambda: self.process_query(q))
-        self._timer.start()
+        if self._query_task:
+          self._query_task.cancel()
+        self._query_task = loop.spawn(self._query_later(q))
     self.prev_q = q
 
+  async def _query_later(self, q):
+    # wait for a pause in the typing, a new keystroke cancels this
+    await asyncio.sleep(0.25)
+    self._query_task = None
+    self.process_query(q)
+
   def get_contexts(self):
     return [self, self.lb]
 
@@ -47,10 +47,15 @@ def disconnect(name, callback):
   except KeyError:
     pass
 
+def connected(name):
+  """Whether anything is connected to the signal."""
+  return bool(_signals.get(name))
+
 def emit(name, *args):
   if name not in _signals:
     raise NameError("No signal named %r" % name)
 
-  for callback in _signals[name]:
+  # handlers may disconnect while the signal is being emitted
+  for callback in list(_signals[name]):
     callback(*args)
 
@@ -22,6 +22,9 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import collections
+import weakref
+
 def humanize_time(milli, str_output=True):
   sec, milli = divmod(milli, 1000)
   min, sec = divmod(sec, 60)
@@ -31,3 +34,86 @@ def humanize_time(milli, str_output=True):
   else:
     hours, min, sec
 
+
+class LRUDict(object):
+  """A dict that forgets its least recently used items past maxsize.
+
+  Lookups by key are counted in hits and misses, peek() doesn't count and
+  doesn't make the item recently used. Named ones show up in lru_stats().
+  """
+
+  def __init__(self, maxsize, on_evict=None, name=None):
+    self.maxsize = maxsize
+    self.on_evict = on_evict
+    self.name = name
+    self._d = collections.OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+    if name is not None:
+      _named_lrus.add(self)
+
+  def __len__(self):
+    return len(self._d)
+
+  def __contains__(self, key):
+    return key in self._d
+
+  def __iter__(self):
+    return iter(self._d)
+
+  def __getitem__(self, key):
+    try:
+      v = self._d[key]
+    except KeyError:
+      self.misses += 1
+      raise
+    self.hits += 1
+    self._d.move_to_end(key)
+    return v
+
+  def __setitem__(self, key, value):
+    self._d[key] = value
+    self._d.move_to_end(key)
+    while len(self._d) > self.maxsize:
+      k, v = self._d.popitem(last=False)
+      if self.on_evict is not None:
+        self.on_evict(k, v)
+
+  def __delitem__(self, key):
+    del self._d[key]
+
+  def get(self, key, default=None):
+    try:
+      return self[key]
+    except KeyError:
+      return default
+
+  def peek(self, key, default=None):
+    return self._d.get(key, default)
+
+  def reset_stats(self):
+    self.hits = self.misses = 0
+
+  def pop(self, key, *default):
+    return self._d.pop(key, *default)
+
+  def clear(self):
+    self._d.clear()
+
+  def keys(self): return self._d.keys()
+  def values(self): return self._d.values()
+  def items(self): return self._d.items()
+
+
+_named_lrus = weakref.WeakSet()
+
+def lru_stats():
+  """Return name => [hits, misses, items] over the named LRUDicts alive."""
+  stats = {}
+  for d in list(_named_lrus):
+    s = stats.setdefault(d.name, [0, 0, 0])
+    s[0] += d.hits
+    s[1] += d.misses
+    s[2] += len(d)
+  return stats
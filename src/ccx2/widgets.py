@@ -38,6 +38,14 @@ class SongWidget(SelectableText):
     self.__super.__init__(*args, **kwargs)
     self.mid = mid
 
+class PlaceholderSongWidget(SongWidget):
+  """Stands in for a song whose info hasn't arrived from the server yet.
+
+  Only needs the id, so rows can be drawn as soon as the ids are known.
+  """
+  def __init__(self, mid, *args, **kwargs):
+    self.__super.__init__(mid, ('placeholder', '#%d' % mid), *args, **kwargs)
+
 class PlaylistWidget(SelectableText):
   def __init__(self, name, *args, **kwargs):
     self.__super.__init__(name, *args, **kwargs)
@@ -22,14 +22,16 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import functools
+import inspect
 import os
 import sys
-import time
-import threading
 
 import xmmsclient
 from xmmsclient import collections as coll
 
+from . import loop
+from . import medialib
 from . import signals
 
 # TODO: better doc (rst)
@@ -101,27 +103,74 @@ def get(name='ccx2', **kwargs):
     _objects[name] = service
     return service
 
-class PlaybackPlaytimeTimer(threading.Thread):
-  def __init__(self, seconds, xmms, fun):
-    self.seconds = seconds
-    self.xmms = xmms
-    self.fun = fun
+def result_future():
+  """Return a future and a callback for an async call that resolves it.
+
+  Errors from the server are raised from the future as XMMSError.
+  """
+  f = loop.future()
+  def _cb(r):
+    if f.cancelled():
+      return
+    if r.iserror():
+      f.set_exception(xmmsclient.XMMSError(r.get_error()))
+      # fire and forget calls don't care, awaiting it still raises
+      f.exception()
+    else:
+      f.set_result(r.value())
+  return f, _cb
+
+def _future_form(method):
+  """Make method return a future when called with sync=False and no cb.
+
+  The future resolves on the main loop, see result_future().
+  """
+  sig = inspect.signature(method)
+
+  @functools.wraps(method)
+  def _w(self, *args, **kwargs):
+    bound = sig.bind(self, *args, **kwargs)
+    if bound.arguments.get('sync', True) or bound.arguments.get('cb') is not None:
+      return method(self, *args, **kwargs)
+    f, bound.arguments['cb'] = result_future()
+    method(*bound.args, **bound.kwargs)
+    return f
+  return _w
+
+class ServerState(object):
+  """What the server last told us, kept up to date from its broadcasts.
+
+  Seeded once on connect, so commands can act on it right away instead of
+  asking first. Anything not known yet is None (or empty).
+  """
+  def __init__(self):
+    self.status = None
+    self.current_id = None
+    self.current_pos = {} # playlist name => position of the current entry
+    self.active_playlist = None
+    self.volume = None # channel => value, or None if there's no volume control
+    self.playlists = []
+
+  def active_pos(self):
+    """Position of the current entry in the active playlist, or None."""
+    return self.current_pos.get(self.active_playlist)
 
-    threading.Thread.__init__(self)
-    self.setDaemon(True)
-
-  def run(self):
-    time.sleep(self.seconds)
-    self.xmms.signal_playback_playtime(self.fun)
-    self.xmms.ioout()
 
 class XmmsService(object):
   def __init__(self, path=None, name='ccx2'):
     super(XmmsService, self).__init__()
+    self.name = name
     self.xmms = xmmsclient.XMMS(name)
-    self.xmms_s = xmmsclient.XMMSSync(name+'-sync')
+    self._xmms_s = None
     self.path = path or os.environ.get("XMMS_PATH", None)
     self.connected = False
+    self.cache = medialib.InfoCache(self)
+
+    self.state = ServerState()
+    self.seeded = None # future, done once the state's been filled in
+    self._playtime_users = set()
+    self._playtime_timer = None
+    self._playtime_waiting = False
 
     self.connect()
 
@@ -131,7 +180,7 @@ class XmmsService(object):
 
     try:
       self.xmms.connect(path=self.path, disconnect_func=disconnect)
-      self.xmms_s.connect(path=self.path)
+      self._xmms_s = None
       self.connected = True
       self.connect_signals()
     except IOError:
@@ -139,6 +188,14 @@ class XmmsService(object):
 
     return self.connected
 
+  @property
+  def xmms_s(self):
+    """The blocking connection, only opened if a sync call is ever made."""
+    if self._xmms_s is None:
+      self._xmms_s = xmmsclient.XMMSSync(self.name+'-sync')
+      self._xmms_s.connect(path=self.path)
+    return self._xmms_s
+
   def _callback_wrapper(self, cb):
     def _w(r):
       if r.iserror():
@@ -175,15 +232,26 @@ class XmmsService(object):
 
   def connect_signals(self):
     self.xmms.broadcast_playback_current_id(self._on_playback_current_id)
-    self.xmms.broadcast_playback_status(self._simple_emit_fun('xmms-playback-status'))
+    self.xmms.broadcast_playback_status(self._on_playback_status)
     self.xmms.broadcast_playback_volume_changed(self._on_playback_volume_changed)
-    self.xmms.broadcast_playlist_loaded(self._simple_emit_fun('xmms-playlist-loaded'))
+    self.xmms.broadcast_playlist_loaded(self._on_playlist_loaded)
     self.xmms.broadcast_playlist_current_pos(self._on_playlist_current_pos)
     self.xmms.broadcast_playlist_changed(self._on_playlist_changed)
     self.xmms.broadcast_collection_changed(self._on_collection_changed)
     self.xmms.broadcast_medialib_entry_changed(
         self._simple_emit_fun('xmms-medialib-entry-changed'))
-    self.xmms.signal_playback_playtime(self._on_playback_playtime)
+
+    # seed the state, the broadcasts keep it going from there
+    self.state = ServerState()
+    self.seeded = loop.future()
+    # the playtime polling starts once the status is known
+    self.xmms.playback_status(self._on_playback_status)
+    self.xmms.playback_current_id(self._on_playback_current_id)
+    self.xmms.playlist_current_active(self._on_playlist_loaded)
+    self.xmms.playlist_current_pos(cb=self._on_playlist_current_pos)
+    self.xmms.playback_volume_get(self._on_playback_volume_changed)
+    # replies come in order, so this one being back means all of them are
+    self.xmms.playlist_list(self._on_playlist_list)
 
     self.ioout()
 
@@ -194,15 +262,45 @@ class XmmsService(object):
   def _on_collection_changed(self, r):
     if not r.iserror():
       v = r.value()
+      if v.get('namespace') == 'Playlists':
+        self._update_playlists(v['name'], v['type'], v.get('newname'))
       signals.emit('xmms-collection-changed',
                    v['name'],
                    v['type'],
                    v.get('namespace'),
                    v.get('newname'))
 
+  def _update_playlists(self, name, type, newname):
+    state = self.state
+    if type == xmmsclient.COLLECTION_CHANGED_ADD:
+      if name not in state.playlists:
+        state.playlists.append(name)
+    elif type == xmmsclient.COLLECTION_CHANGED_REMOVE:
+      if name in state.playlists:
+        state.playlists.remove(name)
+      state.current_pos.pop(name, None)
+    elif type == xmmsclient.COLLECTION_CHANGED_RENAME:
+      state.playlists = [p == name and newname or p for p in state.playlists]
+      if name in state.current_pos:
+        state.current_pos[newname] = state.current_pos.pop(name)
+      if state.active_playlist == name:
+        state.active_playlist = newname
+
+  def _on_playlist_list(self, r):
+    if not r.iserror():
+      self.state.playlists = list(r.value())
+    if not self.seeded.done():
+      self.seeded.set_result(self.state)
+
+  def _on_playlist_loaded(self, r):
+    if not r.iserror():
+      self.state.active_playlist = r.value()
+      signals.emit('xmms-playlist-loaded', self.state.active_playlist)
+
   def _on_playlist_current_pos(self, r):
     if not r.iserror():
       v = r.value()
+      self.state.current_pos[v['name']] = v['position']
       signals.emit('xmms-playlist-current-pos', v['name'], v['position'])
 
   def _on_playlist_changed(self, r):
@@ -215,37 +313,100 @@ class XmmsService(object):
                    v.get('position'),
                    v.get('newposition'))
 
-  def _medialib_get_info_cb(self, r):
-    if not r.iserror() and type(r.value()) == xmmsclient.PropDict:
-      signals.emit('xmms-playback-current-info', r.value())
+  def _medialib_get_info_cb(self, info):
+    if info:
+      signals.emit('xmms-playback-current-info', info)
 
   def _on_playback_current_id(self, r):
-    id = r.value()
+    if r.iserror():
+      return
+
+    id = self.state.current_id = r.value()
     signals.emit('xmms-playback-current-id', id)
-    self.xmms.medialib_get_info(id, self._medialib_get_info_cb)
+    self.cache.get_info(id, cb=self._medialib_get_info_cb, sync=False)
+
+  def want_playtime(self, consumer, want=True):
+    """Ask for 'xmms-playback-playtime' signals on behalf of consumer.
+
+    Playtime is only polled while someone wants it, and only while playing.
+    """
+    had_users = bool(self._playtime_users)
+    if want:
+      self._playtime_users.add(consumer)
+      if not had_users:
+        self._poll_playtime(0)
+    else:
+      self._playtime_users.discard(consumer)
+      if had_users and not self._playtime_users:
+        self._poll_playtime(None)
+
+  def _poll_playtime(self, delay):
+    """Ask for the playtime in delay seconds, or stop asking if delay is None."""
+    if self._playtime_timer:
+      self._playtime_timer.cancel()
+      self._playtime_timer = None
+
+    if delay is None or not self._playtime_users:
+      return
+
+    if delay:
+      self._playtime_timer = loop.call_later(delay, self._request_playtime)
+    else:
+      self._request_playtime()
+
+  def _request_playtime(self):
+    self._playtime_timer = None
+    if not self._playtime_waiting:
+      # sent out by the main loop when it sees the connection wants to write
+      self._playtime_waiting = True
+      self.xmms.signal_playback_playtime(self._on_playback_playtime)
 
   def _on_playback_playtime(self, r):
-    signals.emit('xmms-playback-playtime', r.value())
-    PlaybackPlaytimeTimer(0.2, self.xmms, self._on_playback_playtime).start()
+    self._playtime_waiting = False
+    if r.iserror():
+      return False
+
+    milli = r.value()
+    signals.emit('xmms-playback-playtime', milli)
+
+    if self.state.status == xmmsclient.PLAYBACK_STATUS_PLAY:
+      # everybody shows whole seconds, so wake up just after the next one
+      self._poll_playtime(max((1000 - milli % 1000) / 1000.0 + 0.01, 0.05))
     return False
 
+  def _on_playback_status(self, r):
+    if r.iserror():
+      return
+
+    self.state.status = r.value()
+    signals.emit('xmms-playback-status', self.state.status)
+
+    # once to show where it stopped, polling goes on from there if playing
+    self._poll_playtime(0)
+
   def _on_playback_volume_changed(self, r):
     if not r.iserror():
       channels = r.value()
-      signals.emit('xmms-playback-volume-changed', channels)
+      # a string when there's no volume control
+      if isinstance(channels, dict):
+        self.state.volume = dict(channels)
+        signals.emit('xmms-playback-volume-changed', channels)
 
+  @_future_form
   def bindata_retrieve(self, hash, cb=None, sync=True):
     if sync:
       return self.xmms_s.bindata_retrieve(hash)
     else:
       self.xmms.bindata_retrieve(hash, cb)
 
+  @_future_form
   def coll_get(self, name, ns='Collections', cb=None, sync=True):
     if sync:
       return self.xmms_s.coll_get(name, ns)
     else:
       self.xmms.coll_get(name, ns, cb=cb)
 
+  @_future_form
   def coll_query_ids(self, collection, start=0, leng=0, order=None, cb=None, sync=True):
     if sync:
       try:
@@ -258,6 +419,7 @@ class XmmsService(object):
     else:
       self.xmms.coll_query_ids(collection, start=start, leng=leng, order=order, cb=cb)
 
+  @_future_form
   def coll_query_infos(self, collection, fields, start=0, leng=0,
                        order=None, cb=None, sync=True, add_id=True):
     if add_id and 'id' not in fields:
@@ -274,253 +436,332 @@ class XmmsService(object):
     else:
       self.xmms.coll_query_infos(collection, fields, start=start, leng=leng, order=order, cb=cb)
 
+  @_future_form
   def coll_rename(self, oldname, newname, ns, cb=None, sync=True):
     if sync:
       return self.xmms_s.coll_rename(oldname, newname, ns)
     else:
       self.xmms.coll_rename(oldname, newname, ns, cb=cb)
 
+  @_future_form
   def coll_save(self, collection, name, ns, cb=None, sync=True):
     if sync:
       return self.xmms_s.coll_save(collection, name, ns)
     else:
       self.xmms.coll_save(collection, name, ns, cb=cb)
 
+  @_future_form
   def configval_get(self, key, cb=None, sync=True):
     if sync:
       return self.xmms_s.configval_get(key)
     else:
       self.xmms.configval_get(key, cb=cb)
 
+  @_future_form
   def configval_set(self, key, val, cb=None, sync=True):
     if sync:
       return self.xmms_s.configval_set(key, val)
     else:
       self.xmms.configval_set(key, val, cb=cb)
 
+  @_future_form
   def medialib_get_info(self, id, cb=None, sync=True):
     if sync:
       return self.xmms_s.medialib_get_info(id)
     else:
       return self.xmms.medialib_get_info(id, cb=cb)
 
+  @_future_form
   def medialib_property_set(self, mid, key, value, source=None, cb=None, sync=True):
     if sync:
       return self.xmms_s.medialib_property_set(mid, key, value, source)
     else:
       self.xmms.medialib_property_set(mid, key, value, source, cb)
 
+  @_future_form
   def medialib_property_remove(self, mid, key, source=None, cb=None, sync=True):
     if sync:
       return self.xmms_s.medialib_property_remove(mid, key, source)
     else:
       self.xmms.medialib_property_remove(mid, key, source, cb)
 
+  @_future_form
   def medialib_rehash(self, mid, cb=None, sync=True):
     if sync:
       return self.xmms_s.medialib_rehash(mid)
     else:
       return self.xmms.medialib_rehash(mid, cb=cb)
 
+  @_future_form
   def playback_current_id(self, cb=None, sync=True):
     if sync:
       return self.xmms_s.playback_current_id()
     else:
-      if cb is None:
-        cb = self._on_xmms_playback_current_id
       self.xmms.playback_current_id(cb=cb)
 
   def playback_current_info(self, cb=None, sync=True):
-    i = self.xmms_s.playback_current_id()
+    """Get the current song's info, the future form resolves with it too.
+
+    The info is {} if nothing is playing or it couldn't be fetched.
+    """
     if sync:
-      return self.medialib_get_info(i)
-    elif cb is not None:
-      def _cb(r):
-        if not r.iserror() and type(r.value()) == xmmsclient.PropDict:
-          cb(r.value())
-      self.xmms.medialib_get_info(i, cb=_cb)
+      return self.cache.get_info(self.xmms_s.playback_current_id())
+
+    f = None
+    if cb is None:
+      f = loop.future()
+      def cb(info):
+        if not f.done():
+          f.set_result(info)
+
+    def _with_id(mid):
+      if mid:
+        self.cache.get_info(mid, cb=cb, sync=False)
+      else:
+        cb({})
+
+    if self.state.current_id is not None:
+      _with_id(self.state.current_id)
+    else:
+      def _id_cb(r):
+        _with_id(not r.iserror() and r.value() or 0)
+      self.xmms.playback_current_id(cb=_id_cb)
+    return f
 
+  @_future_form
   def playback_next(self, cb=None, sync=True):
-    self.playlist_set_next(pos=1, relative=True, sync=True)
     if sync:
+      self.playlist_set_next(pos=1, relative=True)
       return self.playback_tickle()
     else:
-      self.playback_tickle()
+      # the server answers in order, no need to wait in between
+      self.playlist_set_next(pos=1, relative=True, sync=False)
+      self.playback_tickle(cb=cb, sync=False)
 
+  @_future_form
   def playback_pause(self, cb=None, sync=True):
     if sync:
       return self.xmms_s.playback_pause()
     else:
       self.xmms.playback_pause(cb=cb)
 
+  @_future_form
   def playback_play_pause_toggle(self, cb=None, sync=True):
-    def __status_cb(res):
-      v = res.value()
-      if v == xmmsclient.PLAYBACK_STATUS_PLAY:
-        self.playback_pause(sync=False)
-      else:
-        self.playback_start(sync=False)
-    self.playback_status(cb=__status_cb, sync=False)
+    if self.state.status == xmmsclient.PLAYBACK_STATUS_PLAY:
+      r = self.playback_pause(cb=cb, sync=sync)
+      status = xmmsclient.PLAYBACK_STATUS_PAUSE
+    else:
+      r = self.playback_start(cb=cb, sync=sync)
+      status = xmmsclient.PLAYBACK_STATUS_PLAY
+
+    # take it as done so a quick second toggle goes the other way, the
+    # broadcast confirms it or puts it right
+    self.state.status = status
+    return r
 
+  @_future_form
   def playback_prev(self, cb=None, sync=True):
-    self.playlist_set_next(pos=-1, relative=True, sync=True)
     if sync:
+      self.playlist_set_next(pos=-1, relative=True)
       return self.playback_tickle()
     else:
-      self.playback_tickle(sync=True)
+      self.playlist_set_next(pos=-1, relative=True, sync=False)
+      self.playback_tickle(cb=cb, sync=False)
 
+  @_future_form
   def playback_seek_ms(self, ms, cb=None, sync=True):
     if sync:
       return self.xmms_s.playback_seek_ms(ms)
     else:
       self.xmms.playback_seek_ms(ms, cb=cb)
 
+  @_future_form
   def playback_seek_ms_rel(self, ms, cb=None, sync=True):
     if sync:
       return self.xmms_s.playback_seek_ms_rel(ms)
     else:
       self.xmms.playback_seek_ms_rel(ms, cb=cb)
 
+  @_future_form
   def playback_start(self, cb=None, sync=True):
     if sync:
       return self.xmms_s.playback_start()
     else:
       self.xmms.playback_start(cb=cb)
 
+  @_future_form
   def playback_status(self, cb=None, sync=True):
     if sync:
       return self.xmms_s.playback_status()
     else:
       self.xmms.playback_status(cb=cb)
 
+  @_future_form
   def playback_stop(self, cb=None, sync=True):
     if sync:
       return self.xmms_s.playback_stop()
     else:
       self.xmms.playback_stop(cb=cb)
 
+  @_future_form
   def playback_tickle(self, cb=None, sync=True):
     if sync:
       return self.xmms_s.playback_tickle()
     else:
       self.xmms.playback_tickle(cb=cb)
 
+  @_future_form
   def playback_volume_get(self, cb=None, sync=True):
     if sync:
       return self.xmms_s.playback_volume_get()
     else:
       self.xmms.playback_volume_get(cb=cb)
 
+  @_future_form
   def playback_volume_set(self, channel, volume, cb=None, sync=True):
+    r = None
     if sync:
-      return self.xmms_s.playback_volume_set(channel, volume)
+      r = self.xmms_s.playback_volume_set(channel, volume)
     else:
       self.xmms.playback_volume_set(channel, volume, cb=cb)
 
+    # changes made before the broadcast comes back build on this one
+    if self.state.volume is not None:
+      self.state.volume[channel] = volume
+    return r
+
+  @_future_form
   def playlist_add_collection(self, coll, order, playlist=None, cb=None, sync=True):
     if sync:
       return self.xmms_s.playlist_add_collection(coll, order, playlist)
     else:
       self.xmms.playlist_add_collection(coll, order, playlist, cb=cb)
 
+  @_future_form
   def playlist_add_id(self, id, playlist, cb=None, sync=True):
     if sync:
       return self.xmms_s.playlist_add_id(id, playlist)
     else:
       self.xmms.playlist_add_id(id, playlist, cb=cb)
 
+  @_future_form
   def playlist_clear(self, playlist=None, cb=None, sync=True):
     if sync:
       return self.xmms_s.playlist_clear(playlist)
     else:
       self.xmms.playlist_clear(playlist, cb=cb)
 
+  @_future_form
   def playlist_create(self, playlist, cb=None, sync=True):
     if sync:
       return self.xmms_s.playlist_create(playlist)
     else:
       self.xmms.playlist_create(playlist, cb=cb)
 
+  @_future_form
   def playlist_current_active(self, cb=None, sync=True):
     if sync:
       return self.xmms_s.playlist_current_active()
     else:
       self.xmms.playlist_current_active(cb=cb)
 
+  @_future_form
   def playlist_current_pos(self, cb=None, sync=True):
     if sync:
       return self.xmms_s.playlist_current_pos()
     else:
       self.xmms.playlist_current_pos(cb=cb)
 
+  @_future_form
   def playlist_insert_collection(self, pos, coll, order, playlist=None, cb=None, sync=True):
     if sync:
       return self.xmms_s.playlist_insert_collection(pos, coll, order, playlist)
     else:
       self.xmms.playlist_insert_collection(pos, coll, order, playlist, cb=cb)
 
+  @_future_form
   def playlist_insert_id(self, pos, id, playlist=None, cb=None, sync=True):
     if sync:
       return self.xmms_s.playlist_insert_id(pos, id, playlist)
     else:
       self.xmms.playlist_insert_id(pos, id, playlist, cb=cb)
 
+  @_future_form
   def playlist_list(self, cb=None, sync=True):
     if sync:
       return self.xmms_s.playlist_list()
     else:
       self.xmms.playlist_list(cb=cb)
 
+  @_future_form
   def playlist_list_entries(self, playlist=None, cb=None, sync=True):
     if sync:
       return self.xmms_s.playlist_list_entries(playlist)
     else:
       self.xmms.playlist_list_entries(playlist, cb=cb)
 
+  @_future_form
   def playlist_load(self, playlist, cb=None, sync=True):
     if sync:
       return self.xmms_s.playlist_load(playlist)
     else:
       self.xmms.playlist_load(playlist, cb=cb)
 
+  @_future_form
   def playlist_move(self, cur_pos, new_pos, playlist=None, cb=None, sync=True):
     if sync:
       return self.xmms_s.playlist_move(cur_pos, new_pos, playlist)
     else:
       self.xmms.playlist_move(cur_pos, new_pos, playlist, cb)
 
-  def playlist_play_pos(self, pos, relative=False):
-    def __status_cb(res):
-      if res.value() != xmmsclient.PLAYBACK_STATUS_PLAY:
+  @_future_form
+  def playlist_play_pos(self, pos, relative=False, cb=None, sync=True):
+    if sync:
+      if self.state.status != xmmsclient.PLAYBACK_STATUS_PLAY:
+        self.playback_start()
+      self.playlist_set_next(pos, relative=relative)
+      return self.playback_tickle()
+    else:
+      if self.state.status != xmmsclient.PLAYBACK_STATUS_PLAY:
         self.playback_start(sync=False)
-
       self.playlist_set_next(pos, relative=relative, sync=False)
-      self.playback_tickle(sync=False)
+      self.playback_tickle(cb=cb, sync=False)
 
-    self.playback_status(cb=__status_cb, sync=False)
+  @_future_form
+  def playlist_play(self, playlist=None, pos=0, relative=False, cb=None, sync=True):
+    if sync:
+      if playlist is not None:
+        self.playlist_load(playlist)
+        return self.playlist_play_pos(pos)
+      return self.playlist_play_pos(pos, relative=relative)
 
-  def playlist_play(self, playlist=None, pos=0, relative=False):
     def __load_cb(res):
-      if not res.iserror():
-        self.playlist_play_pos(pos)
+      if res.iserror():
+        if cb is not None:
+          cb(res)
+      else:
+        self.playlist_play_pos(pos, cb=cb, sync=False)
 
     if playlist is not None:
       self.playlist_load(playlist, __load_cb, sync=False)
     else:
-      self.playlist_play_pos(pos, relative=relative)
+      self.playlist_play_pos(pos, relative=relative, cb=cb, sync=False)
 
+  @_future_form
   def playlist_remove(self, playlist, cb=None, sync=True):
     if sync:
       return self.xmms_s.playlist_remove(playlist)
     else:
       self.xmms.playlist_remove(playlist, cb=cb)
 
+  @_future_form
   def playlist_remove_entry(self, id, playlist=None, cb=None, sync=True):
     if sync:
       return self.xmms_s.playlist_remove_entry(id, playlist)
     else:
       self.xmms.playlist_remove_entry(id, playlist, cb=cb)
 
+  @_future_form
   def playlist_set_next(self, pos, relative=False, cb=None, sync=True):
     if sync:
       if relative:
@@ -536,6 +777,7 @@ class XmmsService(object):
       else:
         self.xmms.playlist_set_next(pos, cb=cb)
 
+  @_future_form
   def playlist_shuffle(self, playlist=None, cb=None, sync=True):
     if sync:
       return self.xmms_s.playlist_shuffle(playlist)
@@ -0,0 +1,111 @@
+# Copyright (c) 2008-2009 Pablo Flouret <quuxbaz@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met: Redistributions of
+# source code must retain the above copyright notice, this list of conditions and
+# the following disclaimer. Redistributions in binary form must reproduce the
+# above copyright notice, this list of conditions and the following disclaimer in
+# the documentation and/or other materials provided with the distribution.
+# Neither the name of the software nor the names of its contributors may be
+# used to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Tests for collutil.IdArray, run from the top of the tree with xmmsclient
+installed:
+
+  python -m unittest discover tests
+"""
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from ccx2.collutil import IdArray
+
+
+class IdArrayTest(unittest.TestCase):
+  def count_layouts(self, a):
+    calls = []
+    layout = a._layout
+    def _layout(chunks):
+      calls.append(len(chunks))
+      layout(chunks)
+    a._layout = _layout
+    return calls
+
+  def test_split_uses_free_slot(self):
+    n = IdArray.CHUNK*2
+    a = IdArray(range(IdArray.CHUNK))
+    a.insert(0, range(IdArray.CHUNK, n))
+    self.assertEqual(a._nchunks, 1)
+
+    layouts = self.count_layouts(a)
+    a.insert(0, [n])
+    self.assertEqual(layouts, [])
+    self.assertEqual(a._nchunks, 2)
+    self.assertEqual(a[:], [n] + list(range(IdArray.CHUNK, n)) + list(range(IdArray.CHUNK)))
+
+  def test_head_inserts_rarely_relayout(self):
+    a = IdArray(range(5000))
+    layouts = self.count_layouts(a)
+    for i in range(20000):
+      a.insert(0, [i])
+    self.assertLess(len(layouts), 10)
+    self.assertEqual(a[:3], [19999, 19998, 19997])
+    self.assertEqual(a[20000:], list(range(5000)))
+
+  def test_tail_inserts_dont_relayout(self):
+    a = IdArray(range(5000))
+    layouts = self.count_layouts(a)
+    for i in range(20000):
+      a.append(i)
+    self.assertEqual(layouts, [])
+    self.assertEqual(a[5000:], list(range(20000)))
+
+  def test_edits_match_list(self):
+    rnd = random.Random(0)
+    ref = [rnd.randrange(50) for _ in range(3000)]
+    a = IdArray(ref)
+    a.positions(0)
+    for step in range(500):
+      op = rnd.random()
+      if op < 0.4:
+        pos = rnd.randrange(len(ref)+1)
+        run = [rnd.randrange(50) for _ in range(rnd.choice([1, 1, 3, 700, 1500]))]
+        ref[pos:pos] = run
+        a.insert(pos, run)
+      elif op < 0.7 and ref:
+        pos = rnd.randrange(len(ref))
+        del ref[pos]
+        a.remove(pos)
+      elif ref:
+        p, q = rnd.randrange(len(ref)), rnd.randrange(len(ref))
+        ref.insert(q, ref.pop(p))
+        a.move(p, q)
+
+      self.assertEqual(len(a), len(ref))
+      s = rnd.randrange(len(ref)+1)
+      e = rnd.randrange(s, len(ref)+1)
+      self.assertEqual(a[s:e], ref[s:e])
+      m = rnd.randrange(50)
+      self.assertEqual(a.positions(m), [i for i, x in enumerate(ref) if x == m])
+
+
+if __name__ == '__main__':
+  unittest.main()
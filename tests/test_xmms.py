@@ -0,0 +1,101 @@
+# Copyright (c) 2008-2009 Pablo Flouret <quuxbaz@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met: Redistributions of
+# source code must retain the above copyright notice, this list of conditions and
+# the following disclaimer. Redistributions in binary form must reproduce the
+# above copyright notice, this list of conditions and the following disclaimer in
+# the documentation and/or other materials provided with the distribution.
+# Neither the name of the software nor the names of its contributors may be
+# used to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Tests for the future forms of XmmsService calls, against a fake
+connection. Run from the top of the tree with xmmsclient installed:
+
+  python -m unittest discover tests
+"""
+
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import xmmsclient
+from xmmsclient import collections as coll
+
+from ccx2 import loop
+from ccx2 import xmms
+
+
+class FakeResult(object):
+  def __init__(self, value=None, error=None):
+    self._value = value
+    self._error = error
+
+  def iserror(self): return self._error is not None
+  def get_error(self): return self._error
+  def value(self): return self._value
+
+
+class FakeXMMS(object):
+  """Answers on the next loop iteration, like replies coming off the socket."""
+
+  def __init__(self, infos):
+    self.infos = infos
+    self.queries = []
+
+  def coll_query_infos(self, collection, fields, start=0, leng=0, order=None, cb=None):
+    self.queries.append(fields)
+    if self.infos is None:
+      loop.call_soon(cb, FakeResult(error='no such collection'))
+    else:
+      loop.call_soon(cb, FakeResult(self.infos))
+
+
+class FutureFormTest(unittest.TestCase):
+  def setUp(self):
+    # nothing listens there, the fake stands in for the connection
+    self.xs = xmms.XmmsService(path='unix:///nonexistent', name='ccx2-test')
+
+  def test_await_coll_query_infos(self):
+    infos = [{'id': 1, 'artist': 'a'}, {'id': 2, 'artist': 'b'}]
+    self.xs.xmms = FakeXMMS(infos)
+
+    async def query():
+      return await self.xs.coll_query_infos(coll.Universe(), ['artist'], sync=False)
+
+    self.assertEqual(loop.wait(query()), infos)
+    self.assertEqual(self.xs.xmms.queries, [['artist', 'id']])
+
+  def test_coll_query_infos_error(self):
+    self.xs.xmms = FakeXMMS(None)
+    f = self.xs.coll_query_infos(coll.Universe(), ['artist'], sync=False)
+    self.assertRaises(xmmsclient.XMMSError, loop.wait, f)
+
+  def test_coll_query_infos_cb(self):
+    self.xs.xmms = FakeXMMS([])
+    got = []
+    r = self.xs.coll_query_infos(coll.Universe(), ['artist'], cb=got.append, sync=False)
+    self.assertIsNone(r)
+    loop.wait(asyncio.sleep(0))
+    self.assertEqual([r.value() for r in got], [[]])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,104 @@
+# Copyright (c) 2008-2009 Pablo Flouret <quuxbaz@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met: Redistributions of
+# source code must retain the above copyright notice, this list of conditions and
+# the following disclaimer. Redistributions in binary form must reproduce the
+# above copyright notice, this list of conditions and the following disclaimer in
+# the documentation and/or other materials provided with the distribution.
+# Neither the name of the software nor the names of its contributors may be
+# used to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Microbenchmarks for collutil.IdArray against a plain list of ids.
+
+Run from the top of the tree, with xmmsclient installed:
+
+  python tools/bench_idarray.py > bench_output.txt
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from ccx2.collutil import IdArray
+
+N = 1000000
+OPS = 5000
+
+def remove(seq, pos):
+  if isinstance(seq, list):
+    del seq[pos]
+  else:
+    seq.remove(pos)
+
+def insert(seq, pos, mid):
+  if isinstance(seq, list):
+    seq.insert(pos, mid)
+  else:
+    seq.insert(pos, [mid])
+
+def op_move(seq, rnd):
+  pos = rnd.randrange(len(seq))
+  mid = seq[pos]
+  remove(seq, pos)
+  insert(seq, rnd.randrange(len(seq)), mid)
+
+def op_insert_first(seq, rnd):
+  insert(seq, 0, 1)
+
+def op_remove(seq, rnd):
+  remove(seq, rnd.randrange(len(seq)))
+
+def op_slice(seq, rnd):
+  # a feeder window
+  start = rnd.randrange(len(seq) - 100)
+  seq[start:start+100]
+
+def op_index(seq, rnd):
+  seq[rnd.randrange(len(seq))]
+
+def op_rows(seq, rnd):
+  # what drawing a screenful does, position_id() for every row
+  start = rnd.randrange(len(seq) - 100)
+  for i in range(start, start+100):
+    seq[i]
+
+def bench(name, op):
+  times = []
+  for kind in (list, IdArray):
+    seq = kind(range(1, N+1))
+    rnd = random.Random(0)
+    start = time.perf_counter()
+    for _ in range(OPS):
+      op(seq, rnd)
+    times.append(time.perf_counter() - start)
+  print('%-16s list %8.4fs   IdArray %8.4fs' % (name, times[0], times[1]))
+
+def main():
+  print('%d ids, %d ops each' % (N, OPS))
+  bench('move', op_move)
+  bench('insert at 0', op_insert_first)
+  bench('remove', op_remove)
+  bench('100-id slice', op_slice)
+  bench('random index', op_index)
+  bench('100 rows', op_rows)
+
+if __name__ == '__main__':
+  main()